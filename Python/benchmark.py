@@ -0,0 +1,530 @@
+"""Benchmarks of the importData pipeline
+
+Usage:
+    python benchmark.py [repeat] [--load]
+        Time the readers on the bundled Python/Data files. --load also
+        compares importing a Copernicus year with batched INSERTs and with
+        LOAD DATA LOCAL INFILE on the database of importData.DB_CONFIG.
+
+    python benchmark.py --suite [--scales 1 10 100] [--mysql] [--output FILE]
+        Synthesize inputs at multiples of the bundled sample sizes and time
+        every stage (parse, transform, sql, load) of every dataset. Loads go
+        to an in-memory SQLite database, or with --mysql to scratch copies of
+        the tables on the database of importData.DB_CONFIG. --output writes
+        the results as JSON ('-' for stdout).
+
+    python benchmark.py --check
+        Export records full of quotes, backslashes and line breaks as SQL
+        commands and as a dump, parse them back and compare the values.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import importData
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data')
+
+POLUTION_FILE = os.path.join(DATA_DIR, 'Polution.xlsx')
+COPERNICUS_FILES = [
+    os.path.join(DATA_DIR, f'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_{year}.csv')
+    for year in (2022, 2023, 2024)
+]
+TREES_FILE = os.path.join(DATA_DIR, 'Trees.xlsx')
+TREE_TYPE_FILE = os.path.join(DATA_DIR, 'trees_thess_0_1_1.csv')
+
+
+def reader_cases():
+    """Return (name, function, arguments) for every reader and bundled input"""
+    cases = [
+        ('meteo_stations', importData.read_meteo_stations_data, (POLUTION_FILE,)),
+        ('pollution', importData.read_pollution_data, (POLUTION_FILE,)),
+    ]
+    for csv_file in COPERNICUS_FILES:
+        year = csv_file.rsplit('_', 1)[1][:4]
+        cases.append((f'copernicus_{year}', importData.read_pollution_copernicus_data, (csv_file,)))
+    cases += [
+        ('tree_types', importData.read_tree_types_data, (TREE_TYPE_FILE,)),
+        ('locations', importData.read_locations_data, (TREES_FILE,)),
+        ('trees', importData.read_trees_data, (TREES_FILE,)),
+    ]
+    return cases
+
+
+def time_reader(function, args, repeat):
+    """Return the best wall time of repeat runs of a reader and the number of records"""
+    best = None
+    for _ in range(repeat):
+        # Time the Excel parsing too instead of serving the sheets parsed by the last call
+        importData._workbooks.clear()
+        start = time.perf_counter()
+        rows = sum(1 for _ in function(*args))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def copernicus_records():
+    """Return the records of the first bundled Copernicus year with a resolved station id"""
+    station_ids = {importData.COPERNICUS_STATION: 1}
+    return list(importData.read_pollution_copernicus_data(COPERNICUS_FILES[0], station_ids))
+
+
+def best_time(function, repeat):
+    """Return the best wall time of repeat calls of function"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_copernicus_formats(repeat):
+    """Time rendering a Copernicus year as batched INSERT statements and as a LOAD DATA file"""
+    records = copernicus_records()
+    handle, tsv_file = tempfile.mkstemp(suffix='.tsv')
+    os.close(handle)
+    try:
+        insert_time = best_time(
+            lambda: [importData.insert_sql(batch) for batch in importData.batch_records(records)], repeat
+        )
+        tsv_time = best_time(lambda: importData.write_tsv(records, tsv_file), repeat)
+    finally:
+        os.remove(tsv_file)
+    return [('insert statements', len(records), insert_time), ('tsv file', len(records), tsv_time)]
+
+
+def benchmark_copernicus_load(repeat):
+    """Time importing a Copernicus year with INSERTs and with LOAD DATA LOCAL INFILE
+
+    Both paths load into a scratch copy of the polution table (without its
+    foreign keys), which is emptied between runs and dropped at the end.
+    """
+    records = copernicus_records()
+    table = 'polution_benchmark'
+    connection = importData.connect_db()
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS tree_db.{table}")
+    cursor.execute(f"CREATE TABLE tree_db.{table} LIKE tree_db.polution")
+
+    def emptied(load):
+        def run():
+            cursor.execute(f"TRUNCATE TABLE tree_db.{table}")
+            load()
+        return run
+
+    try:
+        insert_time = best_time(emptied(
+            lambda: importData.import_data_to_db(iter(records), table=table)
+        ), repeat)
+        infile_time = best_time(emptied(
+            lambda: importData.load_data_infile(iter(records), importData.Pollution, table=table)
+        ), repeat)
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS tree_db.{table}")
+        cursor.close()
+        connection.close()
+    return [('insert load', len(records), insert_time), ('load data infile', len(records), infile_time)]
+
+
+def print_results(title, results):
+    """Print (name, rows, seconds) results as a table"""
+    print(f"\n{title:<20}{'rows':>10}{'seconds':>12}{'rows/sec':>14}")
+    for name, rows, elapsed in results:
+        print(f"{name:<20}{rows:>10}{elapsed:>12.3f}{rows / elapsed:>14.0f}")
+
+
+# Values that the SQL export has to escape, or keep on one line
+AWKWARD_STRINGS = (
+    "O'Brien", "quote at the end'", "\\'", 'back\\slash', 'trailing backslash\\', '\\n is no line break',
+    'line\nbreak', 'carriage\rreturn', 'crlf\r\n', 'tab\there', 'nul\0byte', 'ctrl-z\x1a',
+    'separators \x85\x0b\x0c', 'semicolon;', "'); DROP TABLE tree; --", 'ΑΓΝΩΣΤΟ ΕΙΔΟΣ', ''
+)
+
+# Characters after a backslash in a MySQL string literal, the rest stand for themselves
+SQL_UNESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 'Z': '\x1a'}
+
+
+def awkward_records():
+    """Return tree types and trees whose text values are AWKWARD_STRINGS, the trees with resolved foreign keys"""
+    tree_types = [
+        importData.TreeType(number, text, text[::-1] or None, number * 10)
+        for number, text in enumerate(AWKWARD_STRINGS, start=1)
+    ]
+    type_ids = {tree_type.greek_name: tree_type.type_id for tree_type in tree_types}
+    trees = [
+        importData.Tree(
+            importData.foreign_key(
+                type_ids, text,
+                f"SELECT id FROM tree_db.tree_type WHERE greek_name = {importData.sql_literal(text)} LIMIT 1"
+            ),
+            text, 411482.5 + number, 4498481.25, 40.635024780144, 22.955018989742, None
+        )
+        for number, text in enumerate(AWKWARD_STRINGS)
+    ]
+    return tree_types + trees
+
+
+def parse_sql_string(text, position):
+    """Return the value of the string literal starting at text[position] and the position after it"""
+    chars = []
+    position += 1
+    while position < len(text) and text[position] != "'":
+        if text[position] == '\\' and position + 1 < len(text):
+            position += 1
+            chars.append(SQL_UNESCAPES.get(text[position], text[position]))
+        else:
+            chars.append(text[position])
+        position += 1
+    assert position < len(text), f"Unterminated string literal, was the statement split? {text!r}"
+    return ''.join(chars), position + 1
+
+
+def parse_sql_rows(statement):
+    """Return the rows of an INSERT as lists of values
+
+    Strings are unescaped and NULL is None, numbers, variables and
+    subqueries are kept as their SQL text.
+    """
+    text = statement[statement.index(' VALUES ') + len(' VALUES '):]
+    rows, row, position = [], None, 0
+    while position < len(text):
+        char = text[position]
+        if row is None:
+            if char == '(':
+                row = []
+            elif char != ',' and char != ' ':
+                break  # ON DUPLICATE KEY UPDATE or the semicolon
+            position += 1
+        elif char == ')':
+            rows.append(row)
+            row = None
+            position += 1
+        elif char == ',' or char == ' ':
+            position += 1
+        elif char == "'":
+            value, position = parse_sql_string(text, position)
+            row.append(value)
+        elif char == '(':
+            start, depth = position, 0
+            while position < len(text):
+                if text[position] == "'":
+                    position = parse_sql_string(text, position)[1]
+                    continue
+                depth += {'(': 1, ')': -1}.get(text[position], 0)
+                position += 1
+                if depth == 0:
+                    break
+            row.append(text[start:position])
+        else:
+            start = position
+            while position < len(text) and text[position] not in ',)':
+                position += 1
+            row.append(None if text[start:position] == 'NULL' else text[start:position])
+    return rows
+
+
+def expected_sql_row(record):
+    """Return the values parse_sql_rows should read back for an exported record"""
+    return [
+        value if value is None or isinstance(value, str) else str(value)
+        for value in importData.exported_record(record)
+    ]
+
+
+def check_sql_round_trip():
+    """Export AWKWARD_STRINGS as SQL commands and as a dump, parse them back and compare the values
+
+    The dump is read statement by statement with importData.read_shard,
+    like replay_sql_dump, so a line break that escaped sql_literal would
+    split a statement. Raises AssertionError on the first difference.
+    """
+    records = awkward_records()
+    expected = [expected_sql_row(record) for record in records]
+    with tempfile.TemporaryDirectory() as folder:
+        for upsert in (False, True):
+            sql_file = os.path.join(folder, 'commands.sql')
+            list(importData.export_sql_commands(iter(records), sql_file, upsert))
+            with open(sql_file, encoding='utf-8') as file:
+                rows = [row for line in file for row in parse_sql_rows(line.rstrip('\n'))]
+            assert rows == expected, f"SQL commands differ: {rows} != {expected}"
+
+            dump = os.path.join(folder, 'dump')
+            list(importData.export_sql_dump(iter(records), dump, upsert, chunk_size=4, shard_chunks=2))
+            with open(os.path.join(dump, 'manifest.json'), encoding='utf-8') as file:
+                manifest = json.load(file)
+            rows = []
+            for shard in manifest['shards']:
+                variables = {}
+                for statement in importData.read_shard(os.path.join(dump, shard['file']), manifest['compression']):
+                    if statement.startswith('SET '):
+                        name, lookup = statement[len('SET '):].split(' = ', 1)
+                        variables[name] = lookup
+                    elif statement.startswith('INSERT '):
+                        rows += [[variables.get(value, value) for value in row] for row in parse_sql_rows(statement)]
+                    else:
+                        assert statement in ('START TRANSACTION', 'COMMIT'), f"Unexpected dump line: {statement!r}"
+            assert rows == expected, f"SQL dump differs: {rows} != {expected}"
+    print(f"SQL round trip of {len(records)} records with awkward strings passed")
+
+
+# Multiples of the bundled sample sizes synthesized by the suite
+SCALES = (1, 10, 100)
+
+
+def synthesize_trees(path, scale, rng):
+    """Write a Trees.xlsx shaped workbook with scale copies of the bundled trees
+
+    Every copy after the first gets new _id values and jittered positions.
+    """
+    df = pd.read_excel(TREES_FILE, header=None)
+    header, body = df.iloc[:1], df.iloc[1:]
+    copies = [body]
+    for copy in range(1, scale):
+        rows = body.copy()
+        rows[0] = pd.to_numeric(rows[0], errors='coerce') + copy * len(body)  # _id
+        for column, spread in ((8, 5.0), (9, 5.0), (10, 5e-5), (11, 5e-5)):  # x, y, lat, lon
+            rows[column] = pd.to_numeric(rows[column], errors='coerce') + rng.normal(0, spread, len(rows))
+        copies.append(rows)
+    pd.concat([header] + copies).to_excel(path, header=False, index=False)
+
+
+def synthesize_pollution(path, scale):
+    """Write a Polution.xlsx shaped workbook whose station sheets cover scale times the bundled period
+
+    Every copy of a sheet's rows continues the dates after the previous one.
+    """
+    sheets = pd.read_excel(POLUTION_FILE, sheet_name=None, header=None)
+    with pd.ExcelWriter(path) as writer:
+        for index, (sheet_name, df) in enumerate(sheets.items()):
+            if index > 0:
+                header, body = df.iloc[:1], df.iloc[1:]
+                dates = importData.parse_dates(body[2].where(body[2].notna(), ''))
+                body, dates = body[dates.notna()], dates[dates.notna()]
+                span = dates.max() - dates.min() + pd.Timedelta(days=1)
+                copies = []
+                for copy in range(scale):
+                    rows = body.copy()
+                    rows[1] = pd.to_numeric(rows[1], errors='coerce') + copy * len(body)  # A.A.
+                    rows[2] = dates + copy * span
+                    copies.append(rows)
+                df = pd.concat([header] + copies)
+            df.to_excel(writer, sheet_name=sheet_name, header=False, index=False)
+
+
+def synthesize_copernicus(path, scale):
+    """Write a Copernicus CSV shaped file whose hourly series is scale times the bundled year"""
+    df = pd.read_csv(COPERNICUS_FILES[0])
+    times = pd.to_datetime(df['time'])
+    span = times.max() - times.min() + pd.Timedelta(hours=1)
+    copies = [df.assign(time=(times + copy * span).dt.strftime('%Y-%m-%d %H:%M:%S')) for copy in range(scale)]
+    pd.concat(copies, ignore_index=True).to_csv(path, index=False)
+
+
+def synthesize_inputs(folder, scale, seed=0):
+    """Write the synthetic inputs of a scale to folder and return their paths by dataset
+
+    Existing files are reused, so a workdir can be kept between runs.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = {
+        'polution': os.path.join(folder, 'Polution.xlsx'),
+        'copernicus': os.path.join(folder, 'copernicus.csv'),
+        'trees': os.path.join(folder, 'Trees.xlsx'),
+        'tree_types': TREE_TYPE_FILE
+    }
+    if not os.path.exists(paths['trees']):
+        synthesize_trees(paths['trees'], scale, np.random.default_rng(seed))
+    if not os.path.exists(paths['polution']):
+        synthesize_pollution(paths['polution'], scale)
+    if not os.path.exists(paths['copernicus']):
+        synthesize_copernicus(paths['copernicus'], scale)
+    return paths
+
+
+def sqlite_load(connection, records):
+    """Load records into SQLite tables in batches, the way import_data_to_db loads MySQL"""
+    cursor = connection.cursor()
+    for batch in importData.batch_records(iter(records)):
+        fields = type(batch[0])._fields
+        table = importData.TABLES[type(batch[0])]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, {', '.join(fields)})")
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join(['?'] * len(fields))})", batch
+        )
+        connection.commit()
+
+
+def mysql_load(records):
+    """Load records into a scratch copy of their MySQL table, dropped afterwards"""
+    table = importData.TABLES[type(records[0])]
+    scratch = f"{table}_benchmark"
+    connection = importData.connect_db()
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS tree_db.{scratch}")
+    cursor.execute(f"CREATE TABLE tree_db.{scratch} LIKE tree_db.{table}")
+    try:
+        importData.import_data_to_db(iter(records), table=scratch)
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS tree_db.{scratch}")
+        cursor.close()
+        connection.close()
+
+
+def run_suite(scales, workdir, use_mysql=False):
+    """Time every stage of every dataset at every scale, returns a list of result dicts"""
+    results = []
+
+    def timed(scale, dataset, stage, function):
+        start = time.perf_counter()
+        rows = function()
+        elapsed = time.perf_counter() - start
+        results.append({
+            'scale': scale, 'dataset': dataset, 'stage': stage, 'rows': rows, 'seconds': round(elapsed, 4),
+            'rows_per_sec': round(rows / elapsed) if elapsed > 0 else None
+        })
+        print(f"{scale:>5}x {dataset:<15}{stage:<12}{rows:>10}{elapsed:>10.3f}s")
+
+    for scale in scales:
+        paths = synthesize_inputs(os.path.join(workdir, f"{scale}x"), scale)
+        importData._workbooks.clear()
+
+        # parse: Excel workbooks and the CSV without any transform
+        timed(scale, 'polution', 'parse', lambda: sum(map(len, importData.read_sheets(paths['polution']).values())))
+        timed(scale, 'trees', 'parse', lambda: sum(map(len, importData.read_sheets(paths['trees']).values())))
+        timed(scale, 'copernicus', 'parse', lambda: len(pd.read_csv(paths['copernicus'])))
+
+        # transform: the readers, on the parsed workbooks (the CSV reader parses its chunks again)
+        records = {}
+
+        def transform(dataset, reader):
+            records[dataset] = list(reader())
+            return len(records[dataset])
+
+        timed(scale, 'meteo_station', 'transform', lambda: transform(
+            'meteo_station', lambda: importData.read_meteo_stations_data(paths['polution'])
+        ))
+        station_ids = {record.name: id_value for id_value, record in enumerate(records['meteo_station'], 1)}
+        timed(scale, 'polution', 'transform', lambda: transform(
+            'polution', lambda: importData.read_pollution_data(paths['polution'], station_ids)
+        ))
+        timed(scale, 'copernicus', 'transform', lambda: transform(
+            'copernicus', lambda: importData.read_pollution_copernicus_data(paths['copernicus'], station_ids)
+        ))
+        timed(scale, 'tree_type', 'transform', lambda: transform(
+            'tree_type', lambda: importData.read_tree_types_data(paths['tree_types'])
+        ))
+        timed(scale, 'location', 'transform', lambda: transform(
+            'location', lambda: importData.read_locations_data(paths['trees'])
+        ))
+        type_ids = {record.greek_name: id_value for id_value, record in enumerate(records['tree_type'], 1)}
+        location_ids = {tuple(record[:4]): id_value for id_value, record in enumerate(records['location'], 1)}
+        timed(scale, 'tree', 'transform', lambda: transform(
+            'tree', lambda: importData.read_trees_data(paths['trees'], type_ids, location_ids)
+        ))
+
+        # sql: the SQL text written to the export files
+        for dataset, dataset_records in records.items():
+            timed(scale, dataset, 'sql', lambda: sum(
+                len(batch) for batch in importData.batch_records(iter(dataset_records))
+                if importData.insert_sql(batch)
+            ))
+
+        # load
+        connection = None if use_mysql else sqlite3.connect(':memory:')
+        for dataset, dataset_records in records.items():
+            if use_mysql:
+                timed(scale, dataset, 'load', lambda: mysql_load(dataset_records) or len(dataset_records))
+            else:
+                timed(scale, dataset, 'load', lambda: sqlite_load(connection, dataset_records) or len(dataset_records))
+        if connection is not None:
+            connection.close()
+
+    return results
+
+
+def git_commit():
+    """Return the current git commit of the repository, None outside a checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results, output, load_target):
+    """Write suite results with the details of the run as JSON to output ('-' for stdout)"""
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'load_target': load_target,
+        'results': results
+    }
+    if output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the importData pipeline")
+    parser.add_argument('repeat', nargs='?', type=int, default=3, help="runs per reader timing, the best is kept")
+    parser.add_argument('--load', action='store_true', help="compare the Copernicus import paths on MySQL")
+    parser.add_argument('--suite', action='store_true', help="run the stage suite on synthetic inputs")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES), help="input size multiples")
+    parser.add_argument('--mysql', action='store_true', help="load into MySQL instead of SQLite")
+    parser.add_argument('--workdir', help="folder for the synthetic inputs, kept between runs")
+    parser.add_argument('--output', help="JSON results file of the suite, '-' for stdout")
+    parser.add_argument('--check', action='store_true', help="check the SQL export round trip and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        check_sql_round_trip()
+        return
+
+    if args.suite:
+        if args.workdir:
+            results = run_suite(args.scales, args.workdir, args.mysql)
+        else:
+            with tempfile.TemporaryDirectory() as workdir:
+                results = run_suite(args.scales, workdir, args.mysql)
+        if args.output:
+            write_results(results, args.output, 'mysql' if args.mysql else 'sqlite')
+        return
+
+    repeat = args.repeat
+
+    results = []
+    for name, function, reader_args in reader_cases():
+        elapsed, rows = time_reader(function, reader_args, repeat)
+        results.append((name, rows, elapsed))
+
+    print_results('reader', results)
+    print(f"{'total':<20}{sum(r[1] for r in results):>10}{sum(r[2] for r in results):>12.3f}")
+
+    print_results('copernicus format', benchmark_copernicus_formats(repeat))
+    if args.load:
+        print_results('copernicus import', benchmark_copernicus_load(repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,517 +1,2141 @@
-import pandas as pd
-import mysql.connector
 from datetime import datetime
 import re  # Add this at the top of the file with other imports
+import io
+import sys
+import argparse
+import importlib.util
+import time
+import os
+import json
+import gzip
+import glob
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+import cProfile
+import pstats
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def lazy_import(name):
+    """Return a module that is loaded when it is first used
+
+    pandas, numpy and the MySQL driver take most of the startup time, so
+    commands that do not use them (e.g. replaying a dump without pandas,
+    or --help) do not load them. The loading is not thread-safe, modules
+    used by threads must be loaded before (see load_modules).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+def load_modules(*names):
+    """Load lazily imported modules now"""
+    for name in names:
+        getattr(sys.modules[name], '__name__')
+
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+lazy_import('mysql.connector')
+import mysql
+
+# Number of rows grouped into one multi-row INSERT and committed together.
+# Times the number of columns it must stay below the 65535 placeholders of a
+# prepared statement
+BATCH_SIZE = 1000
+
+# Number of rows of a CSV file transformed at a time
+CSV_CHUNK_SIZE = 10000
+
+# How the Copernicus time series is imported: 'infile' loads a TSV file with
+# LOAD DATA LOCAL INFILE, 'insert' uses batched INSERTs (see import_copernicus_data)
+COPERNICUS_LOAD_MODE = 'infile'
+
+# Import only the inputs that changed since the last import, as upserts
+# (see import_if_changed and UPSERT_KEYS)
+INCREMENTAL_IMPORT = False
+
+# Natural key of every table, the unique key that upserts match rows on
+UPSERT_KEYS = {
+    'meteo_station': ('name',),
+    'polution': ('station_id', 'datetime'),
+    'tree_type': ('greek_name',),
+    'location': ('tax_code', 'street_id', 'street_name', 'street_number'),
+    'tree': ('source_id',)
+}
+
+# Columns the importer adds to the tables of the site, by table (see ensure_columns)
+ADDED_COLUMNS = {
+    # _id of the tree in Trees.xlsx, NULL for the trees added through the site
+    'tree': {'source_id': 'INT NULL'}
+}
+
+# Load with foreign key checks off and the RECOMMENDED_INDEXES dropped, adding
+# the indexes back in one pass per table afterwards (see drop_indexes and ensure_indexes)
+BULK_LOAD = False
+
+# Secondary indexes of the columns the web API filters and joins on, by table
+RECOMMENDED_INDEXES = {
+    'polution': {
+        'idx_polution_datetime': ('datetime',),
+        'idx_polution_station_id': ('station_id',)
+    },
+    'tree': {
+        'idx_tree_type_code': ('type_code',),
+        'idx_tree_inserted_by': ('inserted_by',)
+    },
+    'location': {
+        'idx_location_natural_key': ('tax_code', 'street_id', 'street_name', 'street_number')
+    }
+}
+
+# Rows of every import committed so far, so an interrupted import resumes
+# after its last committed batch (see import_data_to_db)
+IMPORT_CHECKPOINT_DDL = """
+CREATE TABLE IF NOT EXISTS tree_db.import_checkpoint (
+    source VARCHAR(255) NOT NULL PRIMARY KEY,
+    row_count INT NOT NULL,
+    completed BOOLEAN NOT NULL,
+    updated_at DATETIME NOT NULL
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# MySQL errors worth retrying: lost connections, lock wait timeouts and deadlocks
+TRANSIENT_ERRORS = {2006, 2013, 2055, 1205, 1213}
+
+# Retries of an operation failing with a transient error, and the delay before
+# the first one (doubled for every following retry)
+MAX_RETRIES = 5
+RETRY_DELAY = 0.5
+
+# Content hash of every input at its last successful import
+IMPORT_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS tree_db.import_state (
+    source VARCHAR(255) NOT NULL PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    imported_at DATETIME NOT NULL
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# Daily rollups of the pollution series per station and pollutant, read by the dashboard
+POLLUTION_ROLLUP_DDL = """
+CREATE TABLE IF NOT EXISTS tree_db.polution_daily (
+    station_id INT NOT NULL,
+    date DATE NOT NULL,
+    pollutant VARCHAR(16) NOT NULL,
+    avg_value DOUBLE NOT NULL,
+    min_value DOUBLE NOT NULL,
+    max_value DOUBLE NOT NULL,
+    value_count INT NOT NULL,
+    PRIMARY KEY (station_id, date, pollutant),
+    KEY idx_polution_daily_date (date)
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# Columns of the pollution records that are rolled up
+ROLLUP_COLUMNS = ('so2', 'pm10', 'pm25', 'co', 'no', 'no2', 'o3', 'temperature', 'humidity')
+
+# Folder of the columnar archive of the pollution series, Parquet files
+# partitioned by year and station (read by pollutionArchive.py), None to
+# disable it. Needs pyarrow
+POLLUTION_ARCHIVE_DIR = 'insert_db/pollution_archive'
+
+# Zoom levels of the precomputed tree clusters, the map shows single trees above them
+CLUSTER_ZOOMS = range(10, 19)
+
+# Every tile of a cluster zoom level is split in 2**CLUSTER_DETAIL x 2**CLUSTER_DETAIL clusters
+CLUSTER_DETAIL = 2
+
+# Tree clusters per zoom level, keyed by their slippy map tile at zoom + CLUSTER_DETAIL
+TREE_CLUSTER_DDL = """
+CREATE TABLE IF NOT EXISTS tree_db.tree_cluster (
+    zoom TINYINT NOT NULL,
+    tile_x INT NOT NULL,
+    tile_y INT NOT NULL,
+    cluster_x INT NOT NULL,
+    cluster_y INT NOT NULL,
+    tree_count INT NOT NULL,
+    type_code INT NULL,
+    lat DOUBLE NOT NULL,
+    lon DOUBLE NOT NULL,
+    PRIMARY KEY (zoom, cluster_x, cluster_y),
+    KEY idx_tree_cluster_tile (zoom, tile_x, tile_y)
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# Mean Earth radius in meters, for the distances of trees to stations
+EARTH_RADIUS = 6371008.8
+
+# Pollutants averaged per area over the nearest stations of its trees
+AREA_POLLUTANTS = ('so2', 'pm10', 'pm25', 'co', 'no', 'no2', 'o3')
+
+# Nearest station with coordinates of every tree (see nearest_stations)
+TREE_STATION_DDL = """
+CREATE TABLE IF NOT EXISTS tree_db.tree_station (
+    tree_id INT NOT NULL PRIMARY KEY,
+    station_id INT NOT NULL,
+    distance_m DOUBLE NOT NULL,
+    KEY idx_tree_station_station (station_id)
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# Trees, species and canopy of every area, and the average pollutant levels
+# at the nearest stations of its trees (see area_stats)
+AREA_STATS_DDL = f"""
+CREATE TABLE IF NOT EXISTS tree_db.area_stats (
+    area_id INT NOT NULL PRIMARY KEY,
+    tree_count INT NOT NULL,
+    species_count INT NOT NULL,
+    species_diversity DOUBLE NOT NULL,
+    canopy_m3 DOUBLE NOT NULL,
+    {', '.join(f"{pollutant} DOUBLE NULL" for pollutant in AREA_POLLUTANTS)}
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# Version of the data, bumped on every load and on every edit through the API,
+# that the JSON snapshots of the API responses are valid for. The API renders
+# the snapshots of a new version on first request (tree_web/api/snapshots.php)
+DATA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS tree_db.data_version (
+    id TINYINT NOT NULL PRIMARY KEY,
+    version INT NOT NULL,
+    updated_at DATETIME NOT NULL
+) DEFAULT CHARSET = utf8mb4
+"""
+
+# Folder of the packed tree columns for map clients, and the dtype of every column
+TREE_COLUMNS_DIR = 'insert_db/tree_columns'
+TREE_COLUMNS = {
+    'lat': '<f4',
+    'lon': '<f4',
+    'type': '<u2',
+    'location': '<u4'
+}
+
+# Format of the exported SQL: 'dump' writes multi-row INSERTs in transactions
+# to compressed shards (see export_sql_dump), 'sql' one INSERT per row to a
+# single .sql file
+SQL_EXPORT_FORMAT = 'dump'
+
+# Rows of one INSERT of a dump and INSERTs (transactions) of one shard
+SQL_DUMP_CHUNK_SIZE = BATCH_SIZE
+SQL_DUMP_SHARD_CHUNKS = 100
+
+# Compression of the dump shards, 'gzip' or 'zstd' (needs the zstandard package)
+SQL_DUMP_COMPRESSION = 'gzip'
+SQL_DUMP_SUFFIXES = {'gzip': '.sql.gz', 'zstd': '.sql.zst'}
+
+# Number of import stages run at the same time and of processes parsing Excel sheets
+MAX_WORKERS = 4
+
+# Connections kept open for the import stages, None for two per worker
+# (MAX_WORKERS, at most the pool limit of the connector, see connection_pool)
+POOL_SIZE = None
+
+# Seconds to wait for a free pooled connection before giving up
+POOL_TIMEOUT = 60
+
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',  # replace with your MySQL username
+    'password': '',  # replace with your MySQL password
+    'database': 'tree_db'
+}
+
+# Station that holds the Copernicus time series
+COPERNICUS_STATION = 'Copernicus'
+
+# Tree type used when a tree's common name matches no tree type
+UNKNOWN_TREE_TYPE = '_ΑΓΝΩΣΤΟ ΕΙΔΟΣ_'
+
+# Start method of the processes parsing Excel sheets. Not 'fork': a forked
+# process would inherit the connections and locks held by the stage threads
+PARSER_START_METHOD = 'forkserver'
+
+# Folder of the on-disk cache of parsed Excel sheets, None to disable it.
+# Needs pyarrow, the sheets are stored as Feather files (see read_sheets)
+WORKBOOK_CACHE_DIR = None
+
+# Minimum trigram similarity (Jaccard) of a tree name to a tree type name for a fuzzy match
+FUZZY_MATCH_THRESHOLD = 0.5
+
+# JSON file the metrics of every import stage are written to, None to only print them
+METRICS_FILE = 'import_metrics.json'
+
+# Samples kept of the errors of a stage with the same reason
+ERROR_SAMPLES = 5
+
+# Profiler of the import stages: None, 'cprofile' (written to import.prof for
+# pstats/snakeviz) or 'pyinstrument' (written to import_profile.txt). Profiled
+# stages run one at a time
+PROFILER = None
+
+_pool = None
+_pool_lock = threading.Lock()
+_current = threading.local()
+
+# Parsed Excel sheets of this run by file path, and the locks that let one
+# stage parse a file while the others wait for it (see read_sheets)
+_workbooks = {}
+_workbook_locks = {}
+_workbook_locks_lock = threading.Lock()
+
+
+class SqlExpression(str):
+    """SQL text written into a statement as it is, e.g. a lookup subquery"""
+
+
+class ForeignKey(int):
+    """Resolved id of a foreign key that keeps the SqlExpression looking it up
+
+    The loader sends the id, the exported SQL the lookup (see exported_record).
+    """
+
+    def __new__(cls, id, lookup):
+        key = super().__new__(cls, id)
+        key.lookup = lookup
+        return key
+
+
+# Row records yielded by the readers. Their fields are the columns of the
+# table they are inserted into (see TABLES), foreign keys hold the resolved
+# id (a ForeignKey), None or a SqlExpression that looks the id up (see foreign_key).
+
+class MeteoStation(NamedTuple):
+    name: str
+
+
+class Pollution(NamedTuple):
+    number: int
+    station_id: object
+    date: str
+    datetime: str
+    day: str
+    year: int
+    so2: float = None
+    pm10: float = None
+    pm25: float = None
+    co: float = None
+    no: float = None
+    no2: float = None
+    o3: float = None
+    temperature: float = None
+    humidity: float = None
+
+
+class TreeType(NamedTuple):
+    type_id: int
+    greek_name: str
+    scientific_name: str
+    amount: int
+
+
+class Location(NamedTuple):
+    tax_code: str
+    street_id: str
+    street_name: str
+    street_number: str
+    area_id: int
+
+
+class Tree(NamedTuple):
+    type_code: object
+    name: str
+    absolute_position_x: float
+    absolute_position_y: float
+    lat: float
+    lon: float
+    location_id: object
+    source_id: int = None
+
+
+class PollutionRollup(NamedTuple):
+    station_id: int
+    date: str
+    pollutant: str
+    avg_value: float
+    min_value: float
+    max_value: float
+    value_count: int
+
+
+class TreeCluster(NamedTuple):
+    zoom: int
+    tile_x: int
+    tile_y: int
+    cluster_x: int
+    cluster_y: int
+    tree_count: int
+    type_code: object
+    lat: float
+    lon: float
+
+
+class TreeStation(NamedTuple):
+    tree_id: int
+    station_id: int
+    distance_m: float
+
+
+class AreaStats(NamedTuple):
+    area_id: int
+    tree_count: int
+    species_count: int
+    species_diversity: float
+    canopy_m3: float
+    so2: float = None
+    pm10: float = None
+    pm25: float = None
+    co: float = None
+    no: float = None
+    no2: float = None
+    o3: float = None
+
+
+# Table of every record type
+TABLES = {
+    MeteoStation: 'meteo_station',
+    Pollution: 'polution',
+    TreeType: 'tree_type',
+    Location: 'location',
+    Tree: 'tree',
+    PollutionRollup: 'polution_daily',
+    TreeCluster: 'tree_cluster',
+    TreeStation: 'tree_station',
+    AreaStats: 'area_stats'
+}
+
+
+# Escapes of the special characters of SQL string literals
+SQL_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    "'": "\\'",
+    '\0': '\\0',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\x1a': '\\Z'
+})
+
+# Day name of every datetime weekday number
+DAY_NAMES = {
+    0: 'Mon',
+    1: 'Tue',
+    2: 'Wed',
+    3: 'Thu',
+    4: 'Fri',
+    5: 'Sat',
+    6: 'Sun'
+}
+
+
+class StageMetrics:
+    """Counters of an import stage, updated by the readers and loaders it runs
+
+    rows_in are the input rows read, rows_skipped the ones dropped as
+    invalid and rows_out the rows written to the database. errors holds
+    the count and the first ERROR_SAMPLES samples of every error reason.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+        self.seconds = 0.0
+        self.status = 'pending'
+        self.rows_in = 0
+        self.rows_out = 0
+        self.rows_skipped = 0
+        self.bytes_parsed = 0
+        self.round_trips = 0
+        self.errors = {}
+
+    def error(self, reason, sample, skipped=True):
+        """Count an error of an input row, keeping a few samples per reason"""
+        entry = self.errors.setdefault(reason, {'count': 0, 'samples': []})
+        entry['count'] += 1
+        if len(entry['samples']) < ERROR_SAMPLES:
+            entry['samples'].append(sample)
+        if skipped:
+            self.rows_skipped += 1
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'status': self.status,
+            'start': round(self.start, 3),
+            'seconds': round(self.seconds, 3),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rows_skipped': self.rows_skipped,
+            'bytes_parsed': self.bytes_parsed,
+            'round_trips': self.round_trips,
+            'errors': self.errors
+        }
+
+
+def stage_metrics():
+    """Return the metrics of the stage running on this thread (see run_stages)
+
+    Outside of run_stages the counters go to a 'main' StageMetrics of the thread.
+    """
+    metrics = getattr(_current, 'metrics', None)
+    if metrics is None:
+        metrics = _current.metrics = StageMetrics('main')
+    return metrics
+
+
+def clean_text(column):
+    """Collapse the whitespace of a column of strings, missing values become ''"""
+    cleaned = column.astype(str).str.replace(r'\s+', ' ', regex=True).str.strip()
+    return cleaned.where(column.notna(), '')
+
+
+def float_values(column):
+    """Return the values of a column as floats, None where missing or not a number"""
+    numbers = pd.to_numeric(column, errors='coerce')
+    return numbers.astype(object).where(numbers.notna(), None)
+
+
+def int_values(column):
+    """Return the values of a column as ints, None where missing or not a number"""
+    return [None if value is None else int(value) for value in float_values(column)]
+
+
+def parse_dates(column):
+    """Parse a column of dates trying dd/mm/yy first, then any other format
+
+    Cells that match no format become NaT.
+    """
+    text = column.astype(str)
+    dates = pd.to_datetime(text, format='%d/%m/%y', errors='coerce')
+    unparsed = dates.isna()
+    if unparsed.any():
+        dates[unparsed] = pd.to_datetime(text[unparsed], format='mixed', errors='coerce')
+    return dates
+
+
+def file_hash(path):
+    """Return the SHA-256 hash of the contents of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sheet_hash(df):
+    """Return the SHA-256 hash of the cell text of a parsed sheet"""
+    cells = pd.util.hash_pandas_object(df.astype(str), index=True)
+    return hashlib.sha256(cells.values.tobytes()).hexdigest()
+
+
+def workbook_cache_key(path):
+    """Return the cache key of a file, a hash of its contents and modification time"""
+    key = f"{file_hash(path)}{os.stat(path).st_mtime_ns}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def load_cached_sheets(path, cache_dir):
+    """Load the sheets of an Excel file from the on-disk cache, None if not cached"""
+    folder = os.path.join(cache_dir, f"{os.path.basename(path)}-{workbook_cache_key(path)}")
+    manifest = os.path.join(folder, 'sheets.json')
+    if not os.path.exists(manifest):
+        return None
+
+    try:
+        with open(manifest, encoding='utf-8') as file:
+            sheet_names = json.load(file)
+        sheets = {}
+        for index, sheet_name in enumerate(sheet_names):
+            df = pd.read_feather(os.path.join(folder, f"{index}.feather"))
+            df.columns = [int(column) for column in df.columns]
+            sheets[sheet_name] = df
+    except ImportError:
+        print("pyarrow is not installed, the workbook cache is disabled")
+        return None
+
+    print(f"Loaded {len(sheets)} sheets of {os.path.basename(path)} from the workbook cache")
+    return sheets
+
+
+def save_cached_sheets(path, cache_dir, sheets):
+    """Store the sheets of an Excel file in the on-disk cache
+
+    Cells are stored as their text, which is all the readers use of them,
+    so every column is a plain string column. Missing cells stay missing.
+    """
+    folder = os.path.join(cache_dir, f"{os.path.basename(path)}-{workbook_cache_key(path)}")
+    os.makedirs(folder, exist_ok=True)
+
+    try:
+        for index, df in enumerate(sheets.values()):
+            text = df.astype(str).where(df.notna(), None)
+            text.columns = [str(column) for column in text.columns]
+            text.reset_index(drop=True).to_feather(os.path.join(folder, f"{index}.feather"))
+    except ImportError:
+        print("pyarrow is not installed, the workbook cache is disabled")
+        return
+
+    # Written last so that an interrupted save is never loaded
+    with open(os.path.join(folder, 'sheets.json'), 'w', encoding='utf-8') as file:
+        json.dump(list(sheets), file, ensure_ascii=False)
+
+
+def parse_sheet(path, sheet_name):
+    """Parse one sheet of an Excel file without headers"""
+    return pd.read_excel(path, sheet_name=sheet_name, header=None)
+
+
+def read_sheets(excel_file, cache_dir=None, executor=None):
+    """Return {sheet name: DataFrame} of every sheet of an Excel file
+
+    Each file is parsed once per run and served to every reader from memory,
+    the DataFrames are shared so they must not be modified in place. Sheets
+    are read without headers. With a cache_dir (default WORKBOOK_CACHE_DIR)
+    the parsed sheets are also kept on disk and reused by later runs until
+    the file changes. With an executor (e.g. a ProcessPoolExecutor) the
+    sheets are parsed in parallel. Stages asking for a file another stage
+    is parsing wait for its sheets.
+    """
+    path = os.path.abspath(excel_file)
+    with _workbook_locks_lock:
+        lock = _workbook_locks.setdefault(path, threading.Lock())
+
+    with lock:
+        if path in _workbooks:
+            return _workbooks[path]
+
+        cache_dir = cache_dir or WORKBOOK_CACHE_DIR
+        sheets = load_cached_sheets(path, cache_dir) if cache_dir else None
+        if sheets is None:
+            stage_metrics().bytes_parsed += os.path.getsize(path)
+        if sheets is None and executor is not None:
+            with pd.ExcelFile(path) as excel:
+                sheet_names = excel.sheet_names
+            futures = [executor.submit(parse_sheet, path, sheet_name) for sheet_name in sheet_names]
+            sheets = {sheet_name: future.result() for sheet_name, future in zip(sheet_names, futures)}
+            if cache_dir:
+                save_cached_sheets(path, cache_dir, sheets)
+        elif sheets is None:
+            sheets = pd.read_excel(path, sheet_name=None, header=None)
+            if cache_dir:
+                save_cached_sheets(path, cache_dir, sheets)
+
+        _workbooks[path] = sheets
+    return sheets
+
+
+def connection_pool():
+    """Return the pool of tree_db connections, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            pool_size = min(POOL_SIZE or 2 * MAX_WORKERS, mysql.connector.pooling.CNX_POOL_MAXSIZE)
+            _pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name='tree_db', pool_size=pool_size, allow_local_infile=True, **DB_CONFIG
+            )
+    return _pool
+
+
+def connect_db(**kwargs):
+    """Get a connection to the tree_db database, without foreign key checks when BULK_LOAD
+
+    Connections come from the pool and go back to it when closed. When all
+    are in use it waits up to POOL_TIMEOUT seconds for one to be returned,
+    then raises the PoolError. kwargs open a connection of their own with
+    those extra options instead.
+    """
+    if kwargs:
+        connection = mysql.connector.connect(**DB_CONFIG, **kwargs)
+    else:
+        deadline = time.monotonic() + POOL_TIMEOUT
+        while True:
+            try:
+                connection = connection_pool().get_connection()
+                break
+            except mysql.connector.errors.PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.1)
+    if BULK_LOAD:
+        cursor = connection.cursor()
+        cursor.execute("SET SESSION foreign_key_checks = 0")
+        cursor.close()
+    return connection
+
+
+def load_id_map(table, key_columns):
+    """Load a dict mapping the natural key of every row in a table to its id
+
+    Keys are strings (tuples of strings for more than one key column), NULL
+    columns become None. If a key appears more than once the lowest id wins,
+    like the LIMIT 1 lookups it replaces.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT id, {', '.join(key_columns)} FROM tree_db.{table} ORDER BY id")
+        stage_metrics().round_trips += 1
+        id_map = {}
+        for row in cursor:
+            key = tuple(None if value is None else str(value) for value in row[1:])
+            id_map.setdefault(key if len(key) > 1 else key[0], row[0])
+        cursor.close()
+    finally:
+        connection.close()
+
+    print(f"Loaded {len(id_map)} ids from {table}")
+    return id_map
+
+
+def foreign_key(id_map, key, lookup_sql):
+    """Return the value of a foreign key
+
+    Without an id map the id is looked up by the server with lookup_sql. With
+    an id map the resolved id is returned as a ForeignKey (None if the key is
+    unknown), which is exported as the lookup all the same, so the generated
+    commands stay valid for any database.
+    """
+    lookup = SqlExpression(f"({lookup_sql})")
+    if id_map is None:
+        return lookup
+    id = id_map.get(key)
+    return None if id is None else ForeignKey(id, lookup)
 
 
 def read_meteo_stations_data(excel_file):
-    """Read meteorological stations data from Excel and generate SQL insert commands"""
+    """Read meteorological stations data from Excel and yield MeteoStation records"""
     # Read all sheets
-    excel = pd.ExcelFile(excel_file)
-    sheet_names = excel.sheet_names[1:]  # Skip first sheet
-    sql_commands = []
+    sheets = list(read_sheets(excel_file).values())[1:]  # Skip first sheet
     
-    # Create a set for unique station names
-    unique_stations = set()
-    
-    # First pass: collect unique station names
-    for sheet_name in sheet_names:
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-        station_name = re.sub(r'\s+', ' ', str(df.iloc[0, 0])).strip()
-        unique_stations.add(station_name)
+    # Collect unique station names in order of appearance
+    unique_stations = dict.fromkeys(
+        re.sub(r'\s+', ' ', str(df.iloc[0, 0])).strip() for df in sheets
+    )
+    print(f"Found {len(unique_stations)} unique meteorological stations")
     
-    # Generate INSERT statements for unique stations
     for station_name in unique_stations:
-        sql = f"""
-        INSERT INTO tree_db.meteo_station (
-            name
+        yield MeteoStation(station_name)
+    
+    # Append Copernicus data station
+    yield MeteoStation(COPERNICUS_STATION)
+
+def read_pollution_data(excel_file, station_ids=None, sheet_names=None):
+    """Read pollution data from Excel and yield Pollution records
+
+    station_ids maps station names to meteo_station ids (see load_id_map).
+    sheet_names limits the sheets that are read, by default all but the first.
+    """
+    # Read all sheets
+    sheets = read_sheets(excel_file)
+    
+    # Skip only the first sheet
+    relevant_sheets = list(sheets)[1:] if sheet_names is None else sheet_names
+    
+    for sheet_name in relevant_sheets:
+        df = sheets[sheet_name]
+        
+        # Get location name from the first row, first column and clean it
+        location_name = re.sub(r'\s+', ' ', str(df.iloc[0, 0])).strip()
+        station_id = foreign_key(
+            station_ids, location_name,
+            f"SELECT id FROM tree_db.meteo_station WHERE name = {sql_literal(location_name)} LIMIT 1"
+        )
+        
+        # Skip the first row as it's usually a title and rows without a date (column C)
+        df = df.iloc[1:].reindex(columns=range(14))
+        df = df[df[2].notna()]
+        metrics = stage_metrics()
+        metrics.rows_in += len(df)
+        
+        # Get values by column position
+        # B column (index 1) = A.A.
+        # C column (index 2) = Date
+        # D column (index 3) = Day
+        # E column (index 4) = SO2
+        # F column (index 5) = PM10
+        # G column (index 6) = PM2.5
+        # H column (index 7) = CO
+        # I column (index 8) = NO
+        # J column (index 9) = NO2
+        # K column (index 10) = O3
+        # Last two columns = temperature and humidity
+        
+        # Convert date strings to datetimes with flexible format
+        dates = parse_dates(df[2])
+        for index, date_str in df.loc[dates.isna(), 2].items():
+            metrics.error('unparseable date', f"{sheet_name} row {index - 1}: {date_str}")
+        df = df[dates.notna()]
+        dates = dates[dates.notna()]
+        
+        date = dates.dt.strftime('%Y-%m-%d')
+        columns = zip(
+            int_values(df[1]),  # A.A.
+            date,
+            date + ' 00:00:00',
+            dates.dt.dayofweek.map(DAY_NAMES),
+            dates.dt.year,
+            float_values(df[4]),   # E column - SO2
+            float_values(df[5]),   # F column - PM10
+            float_values(df[6]),   # G column - PM2.5
+            float_values(df[7]),   # H column - CO
+            float_values(df[8]),   # I column - NO
+            float_values(df[9]),   # J column - NO2
+            float_values(df[10]),  # K column - O3
+            float_values(df[12]),  # M column - temperature
+            float_values(df[13])   # N column - humidity
+        )
+        
+        for number, date, datetime_str, day_of_week, year, so2, pm10, pm25, co, no, no2, o3, temperature, humidity in columns:
+            yield Pollution(
+                number, station_id, date, datetime_str, day_of_week, int(year),
+                so2=so2, pm10=pm10, pm25=pm25, co=co, no=no, no2=no2, o3=o3,
+                temperature=temperature, humidity=humidity
+            )
+
+def read_pollution_copernicus_data(csv_file, station_ids=None):
+    """Read pollution data from Copernicus CSV and yield Pollution records
+
+    station_ids maps station names to meteo_station ids (see load_id_map).
+    The file is read in chunks of CSV_CHUNK_SIZE rows.
+    """
+    station_id = foreign_key(
+        station_ids, COPERNICUS_STATION,
+        f"SELECT id FROM tree_db.meteo_station WHERE name = {sql_literal(COPERNICUS_STATION)} LIMIT 1"
+    )
+    
+    metrics = stage_metrics()
+    metrics.bytes_parsed += os.path.getsize(csv_file)
+
+    # Read CSV with headers since column names are needed
+    for df in pd.read_csv(csv_file, chunksize=CSV_CHUNK_SIZE):
+        metrics.rows_in += len(df)
+
+        # Convert time strings to datetimes
+        dates = pd.to_datetime(df['time'], errors='coerce')
+        for index, time_str in df.loc[dates.isna(), 'time'].items():
+            metrics.error('unparseable time', f"row {index}: {time_str}")
+        df = df[dates.notna()]
+        dates = dates[dates.notna()]
+        
+        columns = zip(
+            df.index + 1,
+            dates.dt.strftime('%Y-%m-%d'),
+            dates.dt.strftime('%Y-%m-%d %H:%M:%S'),
+            dates.dt.dayofweek.map(DAY_NAMES),
+            dates.dt.year,
+            float_values(df['so2_conc']),
+            float_values(df['co_conc']),
+            float_values(df['no_conc']),
+            float_values(df['no2_conc']),
+            float_values(df['o3_conc'])
+        )
+        
+        for number, date, datetime_str, day_of_week, year, so2, co, no, no2, o3 in columns:
+            yield Pollution(
+                int(number), station_id, date, datetime_str, day_of_week, int(year),
+                so2=so2, co=co, no=no, no2=no2, o3=o3
+            )
+
+def read_tree_types_data(csv_file):
+    """Read tree types data from CSV and yield TreeType records"""
+    # Read CSV without headers and skip header row
+    df = pd.read_csv(csv_file, header=None).iloc[1:]
+    metrics = stage_metrics()
+    metrics.bytes_parsed += os.path.getsize(csv_file)
+    metrics.rows_in += len(df)
+    
+    # Clean string values and handle NULL values
+    # Column positions:
+    # 0: type_id
+    # 1: greek_name
+    # 2: scientific_name
+    # 3-8: md1-md6
+    # 9: total
+    # 10: area_m2
+    # 11: crown_volume_m3
+    # 12: avg_crown_volume_m3
+    columns = zip(
+        int_values(df[0]),
+        clean_text(df[1]),
+        clean_text(df[2]),
+        int_values(df[5])  # md3
+    )
+    
+    for type_id, greek_name, scientific_name, md3 in columns:
+        yield TreeType(type_id, greek_name, scientific_name, 0 if md3 is None else md3)
+
+
+def normalize_name(name):
+    """Return the index key of a species name
+
+    Accents are stripped, case is folded and punctuation and runs of
+    whitespace become a single space, e.g. 'Καλ. δαμασκηνιά' -> 'καλ δαμασκηνια'.
+    """
+    text = ''.join(char for char in unicodedata.normalize('NFD', str(name)) if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[\W_]+', ' ', text.casefold()).split())
+
+
+def name_trigrams(key):
+    """Return the set of character trigrams of an index key, padded at the word boundaries"""
+    padded = f"  {key} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class SpeciesIndex:
+    """Resolves tree names to tree type greek names
+
+    Built from TreeType records (see read_tree_types_data), keyed by the
+    normalized greek and scientific names of every type (see
+    normalize_name). A name without an exact key resolves to the type
+    whose key shares the most trigrams with it, if similar enough
+    (FUZZY_MATCH_THRESHOLD). Every distinct name is resolved once and then
+    served from a dict.
+    """
+
+    def __init__(self, tree_types):
+        tree_types = list(tree_types)
+        self.names = {}
+        self.trigrams = {}
+        self.resolved = {}
+        # Greek names take precedence over scientific names with the same key
+        for name, greek_name in [(tree_type.greek_name, tree_type.greek_name) for tree_type in tree_types] + \
+                [(tree_type.scientific_name, tree_type.greek_name) for tree_type in tree_types]:
+            key = normalize_name(name)
+            if key and key not in self.names:
+                self.names[key] = greek_name
+                for trigram in name_trigrams(key):
+                    self.trigrams.setdefault(trigram, []).append(key)
+
+    def resolve(self, name):
+        """Return the greek name of the tree type of a name, None if no type is similar enough"""
+        if name in self.resolved:
+            return self.resolved[name]
+
+        key = normalize_name(name)
+        greek_name = self.names.get(key)
+        if greek_name is None and key:
+            trigrams = name_trigrams(key)
+            shared = Counter(candidate for trigram in trigrams for candidate in self.trigrams.get(trigram, ()))
+            best_key, best_similarity = None, 0.0
+            for candidate, count in shared.items():
+                similarity = count / (len(trigrams) + len(name_trigrams(candidate)) - count)
+                if similarity > best_similarity:
+                    best_key, best_similarity = candidate, similarity
+            if best_similarity >= FUZZY_MATCH_THRESHOLD:
+                greek_name = self.names[best_key]
+                stage_metrics().error(
+                    'fuzzy tree type match', f"{name} -> {greek_name} ({best_similarity:.2f})", skipped=False
+                )
+
+        self.resolved[name] = greek_name
+        return greek_name
+
+
+def read_addresses(df):
+    """Normalize the address columns of the Trees.xlsx rows
+
+    Returns a DataFrame with tax_code, street_id, street_name and street_number
+    columns. Invalid postal codes become '0' and so do empty or '-' street
+    numbers (kept as strings for the varchar column).
+    """
+    # Handle tax_code - convert to '0' if not a valid postal code
+    tax_code = df[1].astype(str).str.strip().where(df[1].notna(), '0')
+    valid_tax_code = tax_code.str.replace(' ', '').str.fullmatch(r'\s*[+-]?\d+(?:_\d+)*\s*')
+    tax_code = tax_code.where(valid_tax_code.fillna(False).astype(bool), '0')
+    
+    street_number = df[4].astype(str).str.strip().where(df[4].notna(), '0')
+    
+    return pd.DataFrame({
+        'tax_code': tax_code,
+        'street_id': df[2].astype(str).str.strip().where(df[2].notna(), ''),  # odos_id (column C)
+        'street_name': clean_text(df[3]),  # onoma (column D)
+        'street_number': street_number.mask(street_number.isin(['-', '']), '0')
+    }, index=df.index)
+
+
+def read_trees_file(excel_file):
+    """Read the locations and the trees of Trees.xlsx in a single pass
+
+    Every address is normalized once and interned as an integer key. The
+    locations are returned as a list of Location records, one per valid
+    address (see read_locations_data), and every tree refers to its
+    location by its index in that list (-1 if its address is no valid
+    location). Returns (locations, trees), trees being a DataFrame of the
+    source_id (the _id column), common_name, x, y, lat, lon and location
+    columns.
+    """
+    # Read the first sheet of the Excel file
+    df = next(iter(read_sheets(excel_file).values()))
+    
+    # Skip header row
+    df = df.iloc[1:]
+    metrics = stage_metrics()
+    metrics.rows_in += len(df)
+    addresses = read_addresses(df)
+
+    # Interned address key of every row, in order of appearance
+    address_keys, unique_addresses = pd.MultiIndex.from_frame(
+        addresses[['tax_code', 'street_id', 'street_name', 'street_number']]
+    ).factorize()
+    locations = addresses.assign(address_key=address_keys)
+    
+    # dimotiko_diamerismo (column F)
+    area_id = pd.to_numeric(df[5], errors='coerce')
+    for index, value in df.loc[df[5].notna() & area_id.isna(), 5].items():
+        metrics.error('invalid area id', f"row {index}: {value}")
+    locations['area_id'] = area_id.fillna(0).astype(int)
+    locations = locations[df[5].isna() | area_id.notna()]
+    
+    # Skip if essential fields are empty
+    complete = locations['tax_code'].ne('') & locations['street_id'].ne('') & locations['street_name'].ne('')
+    for index in locations.index[~complete]:
+        metrics.error('incomplete address', f"row {index}")
+    locations = locations[complete]
+    
+    # One location per street (tax_code, street_id, street_name) and number, with the
+    # area of the first row of the street, grouped by street in order of appearance
+    street_key = ['tax_code', 'street_id', 'street_name']
+    streets = locations.groupby(street_key, sort=False)
+    locations = locations.assign(
+        area_id=streets['area_id'].transform('first'),
+        street_order=streets.ngroup()
+    )
+    locations = locations.drop_duplicates('address_key')
+    locations = locations.sort_values('street_order', kind='stable')
+    
+    print(f"Found {locations['street_order'].nunique()} unique streets with {len(locations)} total addresses")
+
+    # Location index of every interned address key, -1 for the keys without a location
+    location_index = np.full(len(unique_addresses), -1, dtype=np.int64)
+    location_index[locations['address_key'].to_numpy()] = np.arange(len(locations))
+
+    trees = pd.DataFrame({
+        'source_id': pd.to_numeric(df[0], errors='coerce').astype('Int64'),
+        'common_name': clean_text(df[7]),
+        'x': float_values(df[8]),
+        'y': float_values(df[9]),
+        'lat': float_values(df[10]),
+        'lon': float_values(df[11]),
+        'location': location_index[address_keys]
+    }, index=df.index)
+
+    locations = [
+        Location(tax_code, street_id, street_name, number, int(area_id))
+        for tax_code, street_id, street_name, number, area_id in zip(
+            locations['tax_code'], locations['street_id'], locations['street_name'],
+            locations['street_number'], locations['area_id']
+        )
+    ]
+    return locations, trees
+
+
+def tree_records(locations, trees, type_ids=None, location_ids=None, species=None):
+    """Yield the Tree records of the output of read_trees_file
+
+    type_ids maps greek names to tree_type ids and location_ids maps
+    (tax_code, street_id, street_name, street_number) to location ids
+    (see load_id_map). Trees without a location get a NULL location_id.
+    With a SpeciesIndex the common names are matched to the tree types
+    regardless of accents, case and spacing, and fuzzily if need be,
+    otherwise exactly.
+    """
+    # Resolved once per location instead of once per tree
+    location_keys = [
+        foreign_key(
+            location_ids, tuple(location[:4]),
+            f"SELECT l.id FROM tree_db.location l WHERE l.tax_code = {sql_literal(location.tax_code)} "
+            f"AND l.street_id = {sql_literal(location.street_id)} "
+            f"AND l.street_name = {sql_literal(location.street_name)} "
+            f"AND l.street_number = {sql_literal(location.street_number)} LIMIT 1"
+        )
+        for location in locations
+    ]
+
+    metrics = stage_metrics()
+    for source_id, common_name, x, y, lat, lon, location in zip(
+        trees['source_id'], trees['common_name'], trees['x'], trees['y'], trees['lat'], trees['lon'], trees['location']
+    ):
+        greek_name = (species.resolve(common_name) if species is not None else None) or common_name
+
+        # Fall back to the unknown tree type if the common name has no type
+        if type_ids is not None and greek_name not in type_ids:
+            metrics.error('unknown tree type', common_name, skipped=False)
+        type_id = foreign_key(
+            type_ids, greek_name if type_ids and greek_name in type_ids else UNKNOWN_TREE_TYPE,
+            f"SELECT COALESCE("
+            f"(SELECT tt.id FROM tree_db.tree_type tt WHERE tt.greek_name = {sql_literal(greek_name)} LIMIT 1), "
+            f"(SELECT tt.id FROM tree_db.tree_type tt WHERE tt.greek_name = {sql_literal(UNKNOWN_TREE_TYPE)} LIMIT 1))"
+        )
+        
+        yield Tree(
+            type_id, common_name, x, y, lat, lon, location_keys[location] if location >= 0 else None,
+            None if pd.isna(source_id) else int(source_id)
+        )
+
+
+def read_locations_data(excel_file):
+    """Read locations data from Excel and yield Location records"""
+    yield from read_trees_file(excel_file)[0]
+
+
+def read_trees_data(excel_file, type_ids=None, location_ids=None, species=None):
+    """Read trees data from Excel and yield Tree records (see tree_records)"""
+    yield from tree_records(*read_trees_file(excel_file), type_ids, location_ids, species)
+
+
+def sql_literal(value):
+    """Format a record value as SQL, strings are escaped for the mysql client"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, SqlExpression):
+        return value
+    if isinstance(value, str):
+        return f"'{value.translate(SQL_ESCAPES)}'"
+    return str(value)
+
+
+@lru_cache(maxsize=None)
+def insert_template(record_type, rows=1, table=None, upsert=False):
+    """Return an INSERT of rows records of a type with %s placeholders for the values
+
+    table defaults to the table of the records (see TABLES). With upsert,
+    rows whose natural key already exists are updated instead (see UPSERT_KEYS).
+    """
+    fields = record_type._fields
+    row = f"({', '.join(['%s'] * len(fields))})"
+    sql = f"INSERT INTO tree_db.{table or TABLES[record_type]} ({', '.join(fields)}) VALUES {', '.join([row] * rows)}"
+    if upsert:
+        sql += " ON DUPLICATE KEY UPDATE " + ', '.join(f"{field} = VALUES({field})" for field in fields)
+    return sql
+
+
+def insert_statement(records, table=None, upsert=False):
+    """Return the (statement template, parameters) pair that inserts records of the same type
+
+    Every full batch has the same template, so a prepared statement is
+    parsed by the server once and reused.
+    """
+    params = tuple(value for record in records for value in record)
+    return insert_template(type(records[0]), len(records), table, upsert), params
+
+
+def insert_sql(records, table=None, upsert=False):
+    """Return the INSERT of records of the same type as SQL text with escaped values
+
+    Used for the SQL files, the loader sends the values as parameters.
+    """
+    template, params = insert_statement(records, table, upsert)
+    return template % tuple(sql_literal(value) for value in params) + ';'
+
+
+def exported_record(record):
+    """Return a record with its resolved foreign keys replaced by their lookups, for the SQL files"""
+    lookups = {field: value.lookup for field, value in zip(record._fields, record) if isinstance(value, ForeignKey)}
+    return record._replace(**lookups) if lookups else record
+
+
+def batch_records(records, batch_size=BATCH_SIZE):
+    """Group consecutive records of the same type into lists of at most batch_size"""
+    batch = []
+    for record in records:
+        if batch and (type(record) is not type(batch[0]) or len(batch) >= batch_size):
+            yield batch
+            batch = []
+        batch.append(record)
+    if batch:
+        yield batch
+
+
+def with_retry(function, *args):
+    """Return function(*args), retrying with exponential backoff on TRANSIENT_ERRORS"""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return function(*args)
+        except mysql.connector.Error as error:
+            if error.errno not in TRANSIENT_ERRORS or attempt == MAX_RETRIES:
+                raise
+            delay = RETRY_DELAY * 2 ** attempt
+            print(f"Retrying in {delay:.1f}s after a transient error: {error}")
+            time.sleep(delay)
+
+
+def read_checkpoint(source, cursor=None):
+    """Return the (committed rows, completed) of the last import of a source, (0, False) if none
+
+    Reads with cursor if given (e.g. the one of the import, so it needs no
+    second pooled connection), otherwise on a connection of its own.
+    """
+    def read(cursor):
+        cursor.execute(IMPORT_CHECKPOINT_DDL)
+        cursor.execute("SELECT row_count, completed FROM tree_db.import_checkpoint WHERE source = %s", (source,))
+        row = cursor.fetchone()
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def read_connected():
+        connection = connect_db()
+        try:
+            cursor = connection.cursor()
+            checkpoint = read(cursor)
+            cursor.close()
+        finally:
+            connection.close()
+        return checkpoint
+
+    return read(cursor) if cursor is not None else with_retry(read_connected)
+
+
+def save_checkpoint(cursor, source, row_count, completed=False):
+    """Record the committed rows of an import, in the transaction of the cursor that imported them"""
+    cursor.execute(
+        "INSERT INTO tree_db.import_checkpoint (source, row_count, completed, updated_at) VALUES (%s, %s, %s, NOW()) "
+        "ON DUPLICATE KEY UPDATE row_count = VALUES(row_count), completed = VALUES(completed), "
+        "updated_at = VALUES(updated_at)",
+        (source, row_count, completed)
+    )
+
+
+def clear_checkpoints():
+    """Forget the checkpoints once every import finished, so the next import starts over"""
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(IMPORT_CHECKPOINT_DDL)
+        cursor.execute("DELETE FROM tree_db.import_checkpoint")
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def import_data_to_db(records, batch_size=BATCH_SIZE, commit_per_batch=True, table=None, upsert=False,
+                      checkpoint=None, replace=None):
+    """Import records to MySQL database in batches of multi-row INSERTs
+
+    The batches are sent as prepared statements with the values as
+    parameters, batches whose foreign keys are lookups (no id maps were
+    given to the reader) as SQL text. The records are consumed as they are
+    produced, so only one batch is held in memory. With commit_per_batch
+    every batch is committed on its own, otherwise all records are committed
+    once at the end. table overrides the table of the records and upsert
+    updates rows that already exist. replace names a table whose rows are
+    deleted in the transaction of the import, which is then committed once,
+    so readers see the old rows until the new ones replace them.
+
+    With commit_per_batch a batch failing with a transient error is retried
+    on a new connection. With a checkpoint (a name of the input) the number
+    of committed rows is saved in the transaction of every batch, and the
+    rows an earlier interrupted import committed are consumed without being
+    imported again. A lost connection during a COMMIT leaves open whether
+    the server applied it, so a batch is only sent again if the checkpoint
+    read on the new connection shows it was not committed; without a
+    checkpoint such a batch is not retried. Returns the number of imported
+    rows (including those committed before), None if the import failed.
+    """
+    connection = cursor = text_cursor = None
+    broken = False
+    metrics = stage_metrics()
+
+    def reconnect():
+        nonlocal connection, cursor, text_cursor, broken
+        if connection is not None:
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+        connection = connect_db()
+        cursor = connection.cursor(prepared=True)
+        text_cursor = connection.cursor()
+        broken = False
+
+    def send(batch, row_count):
+        nonlocal broken
+        committing = False
+        try:
+            if broken:
+                reconnect()
+                if checkpoint and read_checkpoint(checkpoint, text_cursor)[0] >= row_count:
+                    # The COMMIT of the batch was applied before the connection was lost
+                    metrics.round_trips += 1
+                    metrics.rows_out += len(batch)
+                    return
+            if any(isinstance(value, SqlExpression) for record in batch for value in record):
+                text_cursor.execute(insert_sql(batch, table, upsert))
+            else:
+                cursor.execute(*insert_statement(batch, table, upsert))
+            metrics.round_trips += 1
+            if commit_per_batch:
+                if checkpoint:
+                    save_checkpoint(text_cursor, checkpoint, row_count)
+                    metrics.round_trips += 1
+                committing = True
+                connection.commit()
+                metrics.round_trips += 1
+            metrics.rows_out += len(batch)
+        except mysql.connector.Error as error:
+            # The batch is sent again on a new connection, the old one rolls back when returned to the pool
+            broken = True
+            if committing and not checkpoint:
+                raise mysql.connector.Error(msg=f"Batch may have been committed, not retrying: {error}") from error
+            raise
+
+    if replace:
+        commit_per_batch = False
+
+    try:
+        reconnect()
+        if replace:
+            text_cursor.execute(f"DELETE FROM tree_db.{replace}")
+            metrics.round_trips += 1
+        committed_rows, completed = read_checkpoint(checkpoint, text_cursor) if checkpoint else (0, False)
+        if completed:
+            print(f"Skipping {checkpoint}: imported completely by an earlier run")
+        elif committed_rows:
+            print(f"Resuming {checkpoint} after {committed_rows} committed rows")
+
+        start = time.perf_counter()
+        total_rows = 0
+        for batch in batch_records(records, batch_size):
+            skip = len(batch) if completed else min(len(batch), max(committed_rows - total_rows, 0))
+            total_rows += len(batch)
+            if skip < len(batch):
+                if commit_per_batch:
+                    with_retry(send, batch[skip:], total_rows)
+                else:
+                    send(batch[skip:], total_rows)
+        if checkpoint:
+            save_checkpoint(text_cursor, checkpoint, total_rows, completed=True)
+        connection.commit()
+
+        elapsed = time.perf_counter() - start
+        rate = total_rows / elapsed if elapsed > 0 else 0
+        print(f"Data imported successfully! {total_rows} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+        return total_rows
+        
+    except mysql.connector.Error as error:
+        print(f"Failed to import data into MySQL table: {error}")
+        if connection is not None and connection.is_connected():
+            connection.rollback()
+        
+    finally:
+        if connection is not None and connection.is_connected():
+            cursor.close()
+            text_cursor.close()
+            connection.close()
+            print("MySQL connection closed")
+
+def checkpoint_name(sql_file, inputs):
+    """Return the name of the checkpoint of an import of the records read from some input files
+
+    The name holds the SQL file and the paths and content hash of the
+    inputs, so the checkpoint of other inputs, or of an earlier version of
+    them, is never resumed.
+    """
+    digest = hashlib.sha256()
+    for path in inputs:
+        digest.update(f"{os.path.abspath(path)}\0{file_hash(path)}\0".encode('utf-8'))
+    return f"{os.path.basename(sql_file)}:{digest.hexdigest()}"
+
+
+def import_dataset(records, sql_file, upsert=False, inputs=(), replace=None):
+    """Export the records to a SQL file and import them in a single pass
+
+    inputs are the files the records are read from. With inputs the import
+    has a checkpoint (see checkpoint_name), so an interrupted import
+    continues where it stopped (see import_data_to_db). With replace (a
+    table) the records replace its rows in a single transaction.
+    """
+    checkpoint = checkpoint_name(sql_file, inputs) if inputs else None
+    if import_data_to_db(
+        export_sql(records, sql_file, upsert), upsert=upsert, checkpoint=checkpoint, replace=replace
+    ) is None:
+        raise RuntimeError(f"Import of {sql_file} failed")
+
+
+def stored_hash(source):
+    """Return the content hash recorded by the last import of an input, None if never imported"""
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(IMPORT_STATE_DDL)
+        cursor.execute("SELECT content_hash FROM tree_db.import_state WHERE source = %s", (source,))
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        connection.close()
+    return row[0] if row else None
+
+
+def record_import(source, content_hash):
+    """Record the content hash of an input that was imported successfully"""
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(IMPORT_STATE_DDL)
+        cursor.execute(
+            "INSERT INTO tree_db.import_state (source, content_hash, imported_at) VALUES (%s, %s, NOW()) "
+            "ON DUPLICATE KEY UPDATE content_hash = VALUES(content_hash), imported_at = VALUES(imported_at)",
+            (source, content_hash)
+        )
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def inputs_hash(paths):
+    """Return the content hash of the files an input is read from, the file_hash of a single file"""
+    if len(paths) == 1:
+        return file_hash(paths[0])
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(f"{file_hash(path)}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def import_if_changed(source, paths, load, incremental=True):
+    """Run load() unless incremental and the files it reads are unchanged since its last import
+
+    source names the input in the import_state table, e.g. 'tree:Trees.xlsx'.
+    paths are all the files the input is read from, e.g. the trees also
+    depend on the tree types they are matched to.
+    """
+    if not incremental:
+        return load()
+
+    content_hash = inputs_hash(paths)
+    if stored_hash(source) == content_hash:
+        print(f"Skipping {source}: unchanged since the last import")
+        return None
+    result = load()
+    record_import(source, content_hash)
+    return result
+
+
+def ensure_columns(columns=ADDED_COLUMNS):
+    """Add the columns of ADDED_COLUMNS that a table does not have yet"""
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        for table, table_columns in columns.items():
+            for column, definition in table_columns.items():
+                cursor.execute(
+                    "SELECT COUNT(*) FROM information_schema.columns "
+                    "WHERE table_schema = %s AND table_name = %s AND column_name = %s",
+                    (DB_CONFIG['database'], table, column)
+                )
+                if cursor.fetchone()[0]:
+                    continue
+                cursor.execute(f"ALTER TABLE tree_db.{table} ADD COLUMN {column} {definition}")
+                print(f"Added column {column} to {table}")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def ensure_upsert_keys():
+    """Add the unique keys that the upserts match rows on (see UPSERT_KEYS)
+
+    A key on other columns, of an earlier version of UPSERT_KEYS, is
+    replaced. Raises RuntimeError if a key cannot be added, e.g. because the
+    table already holds duplicate rows from earlier full imports.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        for table, columns in UPSERT_KEYS.items():
+            index_name = f"uq_{table}_natural_key"
+            existing = table_indexes(cursor, table).get(index_name)
+            if existing == columns:
+                continue
+            drop = f"DROP INDEX {index_name}, " if existing else ''
+            try:
+                cursor.execute(f"ALTER TABLE tree_db.{table} {drop}ADD UNIQUE KEY {index_name} ({', '.join(columns)})")
+            except mysql.connector.Error as error:
+                raise RuntimeError(
+                    f"Could not add the unique key of {table}, remove its duplicate rows or run a full import: {error}"
+                )
+            print(f"Added unique key ({', '.join(columns)}) to {table}")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def table_indexes(cursor, table):
+    """Return the columns of every secondary index of a table by index name"""
+    cursor.execute(
+        "SELECT index_name, column_name FROM information_schema.statistics "
+        "WHERE table_schema = %s AND table_name = %s AND index_name <> 'PRIMARY' "
+        "ORDER BY index_name, seq_in_index",
+        (DB_CONFIG['database'], table)
+    )
+    indexes = {}
+    for index_name, column_name in cursor.fetchall():
+        indexes[index_name] = indexes.get(index_name, ()) + (column_name,)
+    return indexes
+
+
+def index_ddl(table, indexes):
+    """Return the ALTER TABLE that adds indexes ({name: columns}) to a table in a single pass"""
+    return f"ALTER TABLE tree_db.{table} " + ', '.join(
+        f"ADD INDEX {index_name} ({', '.join(columns)})" for index_name, columns in indexes.items()
+    )
+
+
+def invalid_indexes(cursor, table, table_indexes_wanted):
+    """Return the recommended indexes of a table that are missing or have other columns, with their columns"""
+    existing = table_indexes(cursor, table)
+    return [
+        f"{index_name} ({', '.join(existing.get(index_name, ('missing',)))})"
+        for index_name, columns in table_indexes_wanted.items() if existing.get(index_name) != columns
+    ]
+
+
+def drop_indexes(indexes=RECOMMENDED_INDEXES):
+    """Drop the indexes that exist before a bulk load, they are added back by ensure_indexes
+
+    Indexes that MySQL needs for a foreign key cannot be dropped and are kept.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        for table, table_indexes_wanted in indexes.items():
+            existing = table_indexes(cursor, table)
+            for index_name in table_indexes_wanted:
+                if index_name not in existing:
+                    continue
+                try:
+                    cursor.execute(f"ALTER TABLE tree_db.{table} DROP INDEX {index_name}")
+                    print(f"Dropped index {index_name} of {table} for the load")
+                except mysql.connector.Error as error:
+                    print(f"Keeping index {index_name} of {table}: {error}")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def ensure_indexes(indexes=RECOMMENDED_INDEXES, sql_file='insert_db/indexes.sql'):
+    """Add the missing indexes, one ALTER TABLE per table, and validate them
+
+    The DDL of all the indexes is also written to sql_file. Raises
+    RuntimeError if an index exists with other columns than the recommended
+    ones or is still missing afterwards.
+    """
+    os.makedirs(os.path.dirname(sql_file), exist_ok=True)
+    with open(sql_file, 'w', encoding='utf-8') as file:
+        for table, table_indexes_wanted in indexes.items():
+            file.write(index_ddl(table, table_indexes_wanted) + ';\n')
+
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        for table, table_indexes_wanted in indexes.items():
+            missing = {
+                index_name: columns for index_name, columns in table_indexes_wanted.items()
+                if index_name not in table_indexes(cursor, table)
+            }
+            if missing:
+                start = time.perf_counter()
+                cursor.execute(index_ddl(table, missing))
+                print(f"Added indexes {', '.join(missing)} to {table} in {time.perf_counter() - start:.2f}s")
+
+            invalid = invalid_indexes(cursor, table, table_indexes_wanted)
+            if invalid:
+                raise RuntimeError(f"Indexes of {table} differ from the recommended ones: {', '.join(invalid)}")
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def check_indexes(indexes=RECOMMENDED_INDEXES):
+    """Warn about recommended indexes that are missing or differ, without altering any table
+
+    Returns True if every index is as recommended, see ensure_indexes to add them.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        valid = True
+        for table, table_indexes_wanted in indexes.items():
+            invalid = invalid_indexes(cursor, table, table_indexes_wanted)
+            if invalid:
+                print(f"Warning: indexes of {table} differ from the recommended ones: {', '.join(invalid)}")
+                valid = False
+        cursor.close()
+    finally:
+        connection.close()
+    return valid
+
+
+def tsv_value(value):
+    """Format a record value for a LOAD DATA file, None becomes \\N"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, SqlExpression):
+        raise ValueError("LOAD DATA needs resolved foreign keys, pass the id maps to the reader")
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def write_tsv(records, filename):
+    """Write records to a tab separated file in LOAD DATA format, returns the number of rows"""
+    rows = 0
+    with open(filename, 'w', encoding='utf-8', newline='\n') as file:
+        for record in records:
+            file.write('\t'.join(tsv_value(value) for value in record) + '\n')
+            rows += 1
+    return rows
+
+
+def load_data_infile(records, record_type, table=None, checkpoint=None):
+    """Import records with LOAD DATA LOCAL INFILE through a temporary TSV file
+
+    Much faster than INSERTs for large regular inputs like the Copernicus
+    time series. The foreign keys of the records must be resolved ids.
+    table defaults to the table of record_type. The file is loaded in a
+    single transaction, retried on transient errors. With a checkpoint the
+    records of a file an earlier run loaded completely are only consumed
+    (see import_data_to_db). Returns the number of imported rows, None if
+    the import failed (e.g. local_infile is disabled on the server).
+    """
+    table = table or TABLES[record_type]
+    handle, tsv_file = tempfile.mkstemp(suffix='.tsv')
+    os.close(handle)
+    metrics = stage_metrics()
+
+    def load(total_rows):
+        connection = connect_db()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE '{tsv_file.replace(os.sep, '/')}' INTO TABLE tree_db.{table} "
+                "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                f"({', '.join(record_type._fields)})"
+            )
+            if checkpoint:
+                save_checkpoint(cursor, checkpoint, total_rows, completed=True)
+            connection.commit()
+            cursor.close()
+            metrics.round_trips += 3 if checkpoint else 2
+            metrics.rows_out += total_rows
+        finally:
+            # An uncommitted load is rolled back when the connection goes back to the pool
+            connection.close()
+
+    try:
+        if checkpoint and read_checkpoint(checkpoint)[1]:
+            print(f"Skipping {checkpoint}: loaded completely by an earlier run")
+            return sum(1 for _ in records)
+
+        start = time.perf_counter()
+        total_rows = write_tsv(records, tsv_file)
+        with_retry(load, total_rows)
+
+        elapsed = time.perf_counter() - start
+        rate = total_rows / elapsed if elapsed > 0 else 0
+        print(f"Data loaded successfully! {total_rows} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+        return total_rows
+
+    except mysql.connector.Error as error:
+        print(f"Failed to load data into MySQL table: {error}")
+
+    finally:
+        os.remove(tsv_file)
+
+
+def import_copernicus_data(csv_file, station_ids, sql_file, mode=None, upsert=False):
+    """Export and import a Copernicus CSV, by default with LOAD DATA LOCAL INFILE
+
+    mode is 'infile' or 'insert' (default COPERNICUS_LOAD_MODE). If LOAD DATA
+    fails the file is imported with batched INSERTs instead. Upserts always
+    use INSERTs. The archive of the file is written as it is read and the
+    daily rollups of its station days are recomputed afterwards.
+    """
+    days = set()
+    source = os.path.splitext(os.path.basename(sql_file))[0]
+    if (mode or COPERNICUS_LOAD_MODE) == 'infile' and not upsert:
+        records = export_sql(
+            collect_rollups(archive_pollution(read_pollution_copernicus_data(csv_file, station_ids), source), days),
+            sql_file
+        )
+        if load_data_infile(records, Pollution, checkpoint=checkpoint_name(sql_file, [csv_file])) is not None:
+            import_rollups(days, rollup_file(sql_file))
+            return
+        print(f"Falling back to INSERTs for {csv_file}")
+        days.clear()
+
+    import_dataset(
+        collect_rollups(archive_pollution(read_pollution_copernicus_data(csv_file, station_ids), source), days),
+        sql_file, upsert, [csv_file]
+    )
+    import_rollups(days, rollup_file(sql_file))
+
+
+def station_days(records):
+    """Return the (station id, date) pairs of some pollution records, leaving out records without a resolved station id"""
+    df = pd.DataFrame(records, columns=Pollution._fields)
+    df['station_id'] = pd.to_numeric(df['station_id'], errors='coerce')
+    df = df.dropna(subset=['station_id', 'date'])
+    return set(zip(df['station_id'].astype(int), df['date'].astype(str)))
+
+
+def collect_rollups(records, days, chunk_size=CSV_CHUNK_SIZE):
+    """Pass pollution records on, adding the station days of every chunk of them to days
+
+    Like export_sql_commands this is a generator, so the days to roll up
+    are collected in the same pass as the import.
+    """
+    for chunk in batch_records(records, chunk_size):
+        days.update(station_days(chunk))
+        yield from chunk
+
+
+def rollup_statements(days):
+    """Yield the statements that recompute the rollups of some station days from polution
+
+    One INSERT ... SELECT per station and pollutant, upserting the
+    aggregates of all rows of those days in polution.
+    """
+    dates = {}
+    for station_id, date in days:
+        dates.setdefault(station_id, []).append(date)
+    for station_id, station_dates in sorted(dates.items()):
+        date_list = ', '.join(sql_literal(date) for date in sorted(station_dates))
+        for pollutant in ROLLUP_COLUMNS:
+            yield (
+                f"INSERT INTO tree_db.{TABLES[PollutionRollup]} ({', '.join(PollutionRollup._fields)}) "
+                f"SELECT station_id, date, '{pollutant}', AVG({pollutant}), MIN({pollutant}), MAX({pollutant}), "
+                f"COUNT({pollutant}) FROM tree_db.polution "
+                f"WHERE station_id = {station_id} AND date IN ({date_list}) AND {pollutant} IS NOT NULL "
+                "GROUP BY station_id, date ON DUPLICATE KEY UPDATE "
+                + ', '.join(f"{field} = VALUES({field})" for field in PollutionRollup._fields[3:])
+            )
+
+
+def archive_chunk(records):
+    """Return the archive rows of some pollution records, leaving out records without a resolved station id"""
+    df = pd.DataFrame(records, columns=Pollution._fields)
+    df['station_id'] = pd.to_numeric(df['station_id'], errors='coerce')
+    df = df.dropna(subset=['station_id'])
+    timestamps = pd.to_datetime(df['datetime'])
+    return pd.DataFrame({
+        'year': timestamps.dt.year.astype('int16'),
+        'station_id': df['station_id'].astype('int32'),
+        'datetime': timestamps,
+        **{column: pd.to_numeric(df[column]).astype(float) for column in ROLLUP_COLUMNS}
+    })
+
+
+def archive_pollution(records, source, folder=POLLUTION_ARCHIVE_DIR, chunk_size=CSV_CHUNK_SIZE, partial=False):
+    """Pass pollution records on, writing every chunk of them to the Parquet files of an input in the archive
+
+    A generator like collect_rollups, so only one chunk is held in memory.
+    The files are year=<year>/station_id=<id>/<source>-0.parquet with a row
+    group per chunk, sorted by time so the row group statistics let time
+    range queries skip what they do not need. The earlier files of the
+    source are removed from every partition, as the station ids may have
+    changed since they were written (e.g. after delete_all_data). With
+    partial, the records being only part of the source (the sheets an
+    incremental import loaded), the files are only replaced in the
+    partitions written. Without pyarrow the records are only passed on.
+    """
+    if folder is None:
+        yield from records
+        return
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("pyarrow is not installed, the pollution archive is disabled")
+        yield from records
+        return
+
+    # The partition columns are in the paths of the files
+    schema = pa.schema([('datetime', pa.timestamp('us')), *((column, pa.float64()) for column in ROLLUP_COLUMNS)])
+    if not partial:
+        for path in glob.glob(os.path.join(folder, 'year=*', 'station_id=*', f"{glob.escape(source)}-*.parquet")):
+            os.remove(path)
+    writers = {}
+    rows = 0
+    try:
+        for chunk in batch_records(records, chunk_size):
+            df = archive_chunk(chunk).sort_values(['station_id', 'datetime'], kind='stable')
+            for (year, station_id), partition_rows in df.groupby(['year', 'station_id'], sort=False):
+                if (year, station_id) not in writers:
+                    partition = os.path.join(folder, f"year={year}", f"station_id={station_id}")
+                    os.makedirs(partition, exist_ok=True)
+                    for path in glob.glob(os.path.join(partition, f"{glob.escape(source)}-*.parquet")):
+                        os.remove(path)
+                    writers[year, station_id] = pq.ParquetWriter(os.path.join(partition, f"{source}-0.parquet"), schema)
+                writers[year, station_id].write_table(
+                    pa.Table.from_pandas(partition_rows, schema=schema, preserve_index=False)
+                )
+            rows += len(df)
+            yield from chunk
+    finally:
+        for writer in writers.values():
+            writer.close()
+    print(f"Archived {rows} pollution rows of {source} to {folder}")
+
+
+def rollup_file(sql_file):
+    """Return the SQL file of the rollups of the pollution data exported to sql_file"""
+    return os.path.splitext(sql_file)[0] + '_rollup.sql'
+
+
+def import_rollups(days, sql_file):
+    """Export and run the statements that recompute the rollups of the station days of an imported input
+
+    The rollups are computed from all rows of those days in polution, not
+    only the imported ones, so rows appended to a day that was imported
+    before (e.g. by an hourly feed) are rolled up together with the earlier
+    ones. The rest of polution_daily stays as it is.
+    """
+    statements = list(rollup_statements(days))
+    os.makedirs(os.path.dirname(sql_file) or '.', exist_ok=True)
+    with open(sql_file, 'w', encoding='utf-8') as file:
+        file.writelines(f"{statement};\n" for statement in statements)
+    print(f"SQL commands exported to {sql_file}")
+
+    def run():
+        connection = connect_db()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(POLLUTION_ROLLUP_DDL)
+            for statement in statements:
+                cursor.execute(statement)
+            connection.commit()
+            stage_metrics().round_trips += len(statements) + 2
+            cursor.close()
+        finally:
+            connection.close()
+
+    try:
+        with_retry(run)
+    except mysql.connector.Error as error:
+        raise RuntimeError(f"Import of {sql_file} failed: {error}") from error
+    print(f"Rolled up {len(days)} station days")
+
+
+def tile_coordinates(lat, lon, zoom):
+    """Return the slippy map tile x and y (arrays) of lat/lon arrays at a zoom level"""
+    n = 2 ** zoom
+    x = np.floor((lon + 180) / 360 * n)
+    y = np.floor((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def load_trees():
+    """Return every row of the tree table as a DataFrame with the columns of Tree, in the order of their ids
+
+    Includes the trees added or edited through the site since the import.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT {', '.join(Tree._fields)} FROM tree_db.tree ORDER BY id")
+        trees = pd.DataFrame(cursor.fetchall(), columns=Tree._fields)
+        stage_metrics().round_trips += 1
+        cursor.close()
+    finally:
+        connection.close()
+
+    print(f"Loaded {len(trees)} trees from tree")
+    return trees
+
+
+def tree_clusters(trees, zooms=CLUSTER_ZOOMS):
+    """Yield a TreeCluster per zoom level and cluster cell holding trees
+
+    The cells form a quadtree: the tile of every tree is computed once at the
+    deepest level and the cells of the other levels are its ancestors. A
+    cluster has the number of trees, their centroid and the most common tree
+    type (the lowest type_code on ties).
+    """
+    df = pd.DataFrame(trees, columns=Tree._fields)[['lat', 'lon', 'type_code']].dropna(subset=['lat', 'lon'])
+    if df.empty:
+        return
+    deepest = max(zooms) + CLUSTER_DETAIL
+    x, y = tile_coordinates(df['lat'].to_numpy(float), df['lon'].to_numpy(float), deepest)
+
+    for zoom in zooms:
+        shift = deepest - zoom - CLUSTER_DETAIL
+        df['cluster_x'], df['cluster_y'] = x >> shift, y >> shift
+        cells = df.groupby(['cluster_x', 'cluster_y'])
+        summary = cells.agg(tree_count=('lat', 'size'), lat=('lat', 'mean'), lon=('lon', 'mean'))
+        dominant = (
+            df.groupby(['cluster_x', 'cluster_y', 'type_code']).size().rename('trees').reset_index()
+            .sort_values(['trees', 'type_code'], ascending=[False, True])
+            .drop_duplicates(['cluster_x', 'cluster_y'])
+            .set_index(['cluster_x', 'cluster_y'])['type_code']
+        )
+        summary = summary.join(dominant)
+        for (cluster_x, cluster_y), tree_count, lat, lon, type_code in summary.itertuples(name=None):
+            yield TreeCluster(
+                zoom, int(cluster_x) >> CLUSTER_DETAIL, int(cluster_y) >> CLUSTER_DETAIL,
+                int(cluster_x), int(cluster_y), int(tree_count),
+                None if pd.isna(type_code) else int(type_code), float(lat), float(lon)
+            )
+
+
+def import_tree_clusters(trees, sql_file):
+    """Replace the tree clusters with the ones of trees, the rows of the tree table (see load_trees)
+
+    The old clusters are deleted in the transaction of the new ones, so the
+    map never reads an empty or half-built tree_cluster.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(TREE_CLUSTER_DDL)
+        cursor.close()
+    finally:
+        connection.close()
+    import_dataset(tree_clusters(trees), sql_file, replace='tree_cluster')
+
+
+def read_crown_volumes(csv_file):
+    """Return the average crown volume (m³) of a tree of every type, as a Series indexed by type_id"""
+    # Columns 0: type_id and 12: avg_crown_volume_m3 (see read_tree_types_data)
+    df = pd.read_csv(csv_file, header=None).iloc[1:]
+    return pd.Series(
+        pd.to_numeric(df[12], errors='coerce').to_numpy(float),
+        index=pd.to_numeric(df[0], errors='coerce')
+    ).dropna()
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Return the great-circle distances in meters between arrays of points in degrees"""
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def nearest_stations(lat, lon, station_lat, station_lon, chunk_size=CSV_CHUNK_SIZE):
+    """Return the index of the nearest station of every point and its distance in meters
+
+    The points are projected to the plane around the mean station latitude
+    (exact enough at the scale of a city) and queried against a KD-tree of
+    the stations, from scipy if it is installed, otherwise every station is
+    compared in chunks of chunk_size points.
+    """
+    cos_lat = np.cos(np.radians(np.mean(station_lat)))
+    points = np.column_stack([np.radians(lon) * cos_lat, np.radians(lat)]) * EARTH_RADIUS
+    stations = np.column_stack([np.radians(station_lon) * cos_lat, np.radians(station_lat)]) * EARTH_RADIUS
+    try:
+        from scipy.spatial import cKDTree
+        nearest = cKDTree(stations).query(points)[1]
+    except ImportError:
+        nearest = np.concatenate([
+            ((points[start:start + chunk_size, None, :] - stations[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+            for start in range(0, len(points), chunk_size)
+        ]) if len(points) else np.empty(0, int)
+    return nearest, haversine(lat, lon, station_lat[nearest], station_lon[nearest])
+
+
+def area_stats(trees, crown_volumes, station_averages):
+    """Yield the AreaStats of every area of the trees
+
+    trees is a DataFrame of area_id, type_id and station_id (the nearest
+    station, NaN if none) per tree. The diversity is the Shannon index of
+    the species, the canopy the sum of the average crown volume of the type
+    of every tree (see read_crown_volumes) and the pollutant levels the
+    averages over the trees of their nearest station's levels
+    (station_averages, a DataFrame indexed by station_id).
+    """
+    trees = trees.dropna(subset=['area_id'])
+    species = trees.groupby(['area_id', 'type_id']).size()
+    shares = species / species.groupby(level='area_id').transform('sum')
+    summary = pd.DataFrame({
+        'tree_count': trees.groupby('area_id').size(),
+        'species_count': species.groupby(level='area_id').size(),
+        'species_diversity': -(shares * np.log(shares)).groupby(level='area_id').sum(),
+        'canopy_m3': trees['type_id'].map(crown_volumes).fillna(0).groupby(trees['area_id']).sum()
+    })
+    levels = station_averages.set_axis(station_averages.index.astype(float)) \
+        .reindex(trees['station_id'].to_numpy()).set_axis(trees.index)
+    pollution = levels.groupby(trees['area_id']).mean()
+    summary = summary.join(pollution.reindex(columns=list(AREA_POLLUTANTS)))
+
+    for area_id, row in summary.iterrows():
+        yield AreaStats(
+            int(area_id), int(row['tree_count']), int(row['species_count']),
+            float(row['species_diversity']), float(row['canopy_m3']),
+            *(None if pd.isna(row[pollutant]) else float(row[pollutant]) for pollutant in AREA_POLLUTANTS)
+        )
+
+
+def import_spatial_join(tree_type_file, sql_file):
+    """Replace the nearest stations of the trees and the area aggregates
+
+    Reads the imported trees and stations back, so the trees get their ids
+    and trees added through the site are included. Stations without
+    coordinates are left out; the station averages come from the daily
+    pollution rollups.
+    """
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(TREE_STATION_DDL)
+        cursor.execute(AREA_STATS_DDL)
+        cursor.execute(POLLUTION_ROLLUP_DDL)
+        cursor.execute(
+            "SELECT t.id, t.lat, t.lon, tt.type_id, l.area_id FROM tree_db.tree t "
+            "LEFT JOIN tree_db.tree_type tt ON t.type_code = tt.id "
+            "LEFT JOIN tree_db.location l ON t.location_id = l.id"
         )
-        VALUES (
-            '{station_name}'
-        );
-        """
-        sql_commands.append(sql)
-    
-    # Append Copernicus data station
-    sql = f"""
-    INSERT INTO tree_db.meteo_station (
-        name
+        trees = pd.DataFrame(cursor.fetchall(), columns=['tree_id', 'lat', 'lon', 'type_id', 'area_id'])
+        cursor.execute(
+            "SELECT id, latitude, longitude FROM tree_db.meteo_station "
+            "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+        )
+        stations = pd.DataFrame(cursor.fetchall(), columns=['station_id', 'lat', 'lon'])
+        cursor.execute(
+            "SELECT station_id, pollutant, SUM(avg_value * value_count) / SUM(value_count) "
+            "FROM tree_db.polution_daily GROUP BY station_id, pollutant"
+        )
+        station_averages = pd.DataFrame(cursor.fetchall(), columns=['station_id', 'pollutant', 'value']) \
+            .pivot(index='station_id', columns='pollutant', values='value').astype(float)
+        stage_metrics().round_trips += 3
+        cursor.close()
+    finally:
+        connection.close()
+
+    trees = trees.astype({'lat': float, 'lon': float, 'type_id': float, 'area_id': float})
+    trees['station_id'] = np.nan
+    located = trees.dropna(subset=['lat', 'lon']).index
+    tree_stations = []
+    if stations.empty:
+        print("No meteo station has coordinates, the trees get no nearest station")
+    elif len(located):
+        nearest, distances = nearest_stations(
+            trees.loc[located, 'lat'].to_numpy(), trees.loc[located, 'lon'].to_numpy(),
+            stations['lat'].to_numpy(float), stations['lon'].to_numpy(float)
+        )
+        trees.loc[located, 'station_id'] = stations['station_id'].to_numpy()[nearest]
+        tree_stations = (
+            TreeStation(int(tree_id), int(station_id), float(distance))
+            for tree_id, station_id, distance in zip(trees.loc[located, 'tree_id'], trees.loc[located, 'station_id'], distances)
+        )
+
+    # Each table is replaced in a transaction of its own, so the API reads
+    # the old rows until the new ones are committed
+    import_dataset(tree_stations, sql_file, replace='tree_station')
+    import_dataset(
+        area_stats(trees, read_crown_volumes(tree_type_file), station_averages),
+        f"{os.path.splitext(sql_file)[0]}_areas.sql", replace='area_stats'
     )
-    VALUES ('Copernicus');
-    """
-    sql_commands.append(sql)
 
-    print(f"Found {len(unique_stations)} unique meteorological stations")
-    return sql_commands
 
-def read_pollution_data(excel_file):
-    """Read pollution data from Excel and generate SQL insert commands"""
-    # Read all sheets
-    excel = pd.ExcelFile(excel_file)
-    sheet_names = excel.sheet_names
-    
-    # Skip only the first sheet
-    relevant_sheets = sheet_names[1:]
-    sql_commands = []
-    
-    # Add these day name mappings at the start of the function
-    day_names = {
-        0: 'Mon',
-        1: 'Tue',
-        2: 'Wed',
-        3: 'Thu',
-        4: 'Fri',
-        5: 'Sat',
-        6: 'Sun'
-    }
-    
-    for sheet_name in relevant_sheets:
-        # Read Excel without headers
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-        
-        # Get location name from the first row, first column and clean it
-        location_name = re.sub(r'\s+', ' ', str(df.iloc[0, 0])).strip()
-        
-        # Skip the first row as it's usually a title
-        df = df.iloc[1:]
-        
-        # Reset index to make sure we can access the rows properly
-        df = df.reset_index(drop=True)
-        
-        for index, row in df.iterrows():
-            try:
-                # Skip row if date (column C) is empty
-                if pd.isna(row[2]):
-                    continue
-                
-                # Get values by column position
-                # B column (index 1) = A.A.
-                # C column (index 2) = Date
-                # D column (index 3) = Day
-                # E column (index 4) = SO2
-                # F column (index 5) = PM10
-                # G column (index 6) = PM2.5
-                # H column (index 7) = CO
-                # I column (index 8) = NO
-                # J column (index 9) = NO2
-                # K column (index 10) = O3
-                # Last two columns = temperature and humidity
-                
-                # Convert date string to datetime with flexible format
-                date_str = str(row[2])  # C column
-                try:
-                    # Try first format (dd/mm/yy)
-                    date_obj = pd.to_datetime(date_str, format='%d/%m/%y')
-                except:
-                    try:
-                        # Try second format (yyyy-mm-dd)
-                        date_obj = pd.to_datetime(date_str)
-                    except:
-                        print(f"Could not parse date: {date_str} in row {index}")
-                        continue
-                
-                # Get day name from date_obj
-                day_of_week = day_names[date_obj.weekday()]
-                year = date_obj.year
-                
-                # Get values by column position with better NULL handling
-                values = {
-                    'SO2': row[4] if pd.notna(row[4]) and str(row[4]).strip() != '' else 'NULL',        # E column
-                    'PM10': row[5] if pd.notna(row[5]) and str(row[5]).strip() != '' else 'NULL',       # F column
-                    'PM2.5': row[6] if pd.notna(row[6]) and str(row[6]).strip() != '' else 'NULL',      # G column
-                    'CO': row[7] if pd.notna(row[7]) and str(row[7]).strip() != '' else 'NULL',         # H column
-                    'NO': row[8] if pd.notna(row[8]) and str(row[8]).strip() != '' else 'NULL',         # I column
-                    'NO2': row[9] if pd.notna(row[9]) and str(row[9]).strip() != '' else 'NULL',        # J column
-                    'O3': row[10] if pd.notna(row[10]) and str(row[10]).strip() != '' else 'NULL',      # K column
-                    'temperature': row[12] if pd.notna(row[12]) and str(row[12]).strip() != '' else 'NULL',  # M column
-                    'humidity': row[13] if pd.notna(row[13]) and str(row[13]).strip() != '' else 'NULL'      # N column
-                }
-                
-                sql = f"""
-                SET @station_id = (
-                    SELECT id FROM tree_db.meteo_station 
-                    WHERE name = '{location_name}' 
-                    LIMIT 1
-                );
-                INSERT INTO tree_db.polution (
-                    number, station_id, date, datetime, day, year,
-                    so2, pm10, pm25, co, no, no2, o3,
-                    temperature, humidity
-                )
-                VALUES (
-                    {row[1]},
-                    @station_id,
-                    '{date_obj.strftime('%Y-%m-%d')}',
-                    '{date_obj.strftime('%Y-%m-%d')} 00:00:00',
-                    '{day_of_week}',
-                    {year},
-                    {values['SO2']},
-                    {values['PM10']},
-                    {values['PM2.5']},
-                    {values['CO']},
-                    {values['NO']},
-                    {values['NO2']},
-                    {values['O3']},
-                    {values['temperature']},
-                    {values['humidity']}
-                );
-                """
-                sql_commands.append(sql)
-                
-            except Exception as e:
-                print(f"Error processing row {index} in sheet {sheet_name}: {e}")
-                print(f"Row data: {row}")
-                continue
-    
-    return sql_commands
+def export_tree_columns(trees, type_ids, location_ids, folder=TREE_COLUMNS_DIR):
+    """Write trees, the rows of the tree table (see load_trees), as packed column files for map clients
 
-def read_pollution_copernicus_data(csv_file):
-    """Read pollution data from Copernicus CSV and generate SQL insert commands"""
-    # Read CSV with headers since column names are needed
-    df = pd.read_csv(csv_file)
-    sql_commands = []
-    
-    # Add these day name mappings
-    day_names = {
-        0: 'Mon',
-        1: 'Tue',
-        2: 'Wed',
-        3: 'Thu',
-        4: 'Fri',
-        5: 'Sat',
-        6: 'Sun'
+    lat.bin and lon.bin hold float32 positions, type.bin a uint16 index into
+    species.json and location.bin a uint32 index into locations.json, all
+    little-endian and in the order of the tree ids, so they can be memory-mapped
+    (see read_tree_columns). Trees without a resolved type or location get
+    the largest index of the dtype. manifest.json lists the files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    species = sorted(type_ids.items(), key=lambda item: item[1])
+    locations = sorted(location_ids.items(), key=lambda item: item[1])
+    type_index = {id_value: index for index, (_, id_value) in enumerate(species)}
+    location_index = {id_value: index for index, (_, id_value) in enumerate(locations)}
+
+    df = pd.DataFrame(trees, columns=Tree._fields)
+    columns = {
+        'lat': pd.to_numeric(df['lat']).to_numpy(TREE_COLUMNS['lat']),
+        'lon': pd.to_numeric(df['lon']).to_numpy(TREE_COLUMNS['lon']),
+        'type': df['type_code'].map(type_index).fillna(np.iinfo(TREE_COLUMNS['type']).max).to_numpy(TREE_COLUMNS['type']),
+        'location': df['location_id'].map(location_index).fillna(np.iinfo(TREE_COLUMNS['location']).max)
+                    .to_numpy(TREE_COLUMNS['location'])
     }
-    
-    for index, row in df.iterrows():
-        try:
-            # Convert time string to datetime
-            date_obj = pd.to_datetime(row['time'])
-            
-            # Get day name and year
-            day_of_week = day_names[date_obj.weekday()]
-            year = date_obj.year
-            
-            # Handle values with better NULL handling
-            values = {
-                'SO2': row['so2_conc'] if pd.notna(row['so2_conc']) and str(row['so2_conc']).strip() != '' else 'NULL',
-                'NO': row['no_conc'] if pd.notna(row['no_conc']) and str(row['no_conc']).strip() != '' else 'NULL',
-                'NO2': row['no2_conc'] if pd.notna(row['no2_conc']) and str(row['no2_conc']).strip() != '' else 'NULL',
-                'O3': row['o3_conc'] if pd.notna(row['o3_conc']) and str(row['o3_conc']).strip() != '' else 'NULL',
-                'CO': row['co_conc'] if pd.notna(row['co_conc']) and str(row['co_conc']).strip() != '' else 'NULL',
-            }
-            
-            sql = f"""
-            SET @station_id = (
-                SELECT id FROM tree_db.meteo_station 
-                WHERE name = 'Copernicus'
-                LIMIT 1
-            );
-            INSERT INTO tree_db.polution (
-                number, station_id, date, datetime, day, year,
-                so2, co, no, no2, o3,
-                temperature, humidity, pm10, pm25
-            )
-            VALUES (
-                {index + 1},
-                @station_id,
-                '{date_obj.strftime('%Y-%m-%d')}',
-                '{date_obj.strftime('%Y-%m-%d %H:%M:%S')}',
-                '{day_of_week}',
-                {year},
-                {values['SO2']},
-                {values['CO']},
-                {values['NO']},
-                {values['NO2']},
-                {values['O3']},
-                NULL,
-                NULL,
-                NULL,
-                NULL
-            );
-            """
-            sql_commands.append(sql)
-            
-        except Exception as e:
-            print(f"Error processing row {index}: {e}")
-            print(f"Row data: {row}")
-            continue
-    
-    return sql_commands
+    for name, values in columns.items():
+        values.tofile(os.path.join(folder, f"{name}.bin"))
 
-def read_tree_types_data(csv_file):
-    """Read tree types data from CSV and generate SQL insert commands"""
-    # Read CSV without headers
-    df = pd.read_csv(csv_file, header=None)
-    sql_commands = []
-    
-    for index, row in df.iterrows():
-        try:
-            # Skip header row
-            if index == 0:
-                continue
-                
-            # Clean string values and handle NULL values
-            # Column positions:
-            # 0: type_id
-            # 1: greek_name
-            # 2: scientific_name
-            # 3-8: md1-md6
-            # 9: total
-            # 10: area_m2
-            # 11: crown_volume_m3
-            # 12: avg_crown_volume_m3
-            
-            greek_name = re.sub(r'\s+', ' ', str(row[1])).strip() if pd.notna(row[1]) else ''
-            scientific_name = re.sub(r'\s+', ' ', str(row[2])).strip() if pd.notna(row[2]) else ''
-            
-            # Handle numeric values
-            values = {
-                # 'md1': row[3] if pd.notna(row[3]) and str(row[3]).strip() != '' else 'NULL',
-                # 'md2': row[4] if pd.notna(row[4]) and str(row[4]).strip() != '' else 'NULL',
-                'md3': row[5] if pd.notna(row[5]) and str(row[5]).strip() != '' else '0',
-                # 'md4': row[6] if pd.notna(row[6]) and str(row[6]).strip() != '' else 'NULL',
-                # 'md5': row[7] if pd.notna(row[7]) and str(row[7]).strip() != '' else 'NULL',
-                # 'md6': row[8] if pd.notna(row[8]) and str(row[8]).strip() != '' else 'NULL',
-                # 'total': row[9] if pd.notna(row[9]) and str(row[9]).strip() != '' else 'NULL',
-                # 'area_m2': row[10] if pd.notna(row[10]) and str(row[10]).strip() != '' else 'NULL',
-                # 'crown_volume_m3': row[11] if pd.notna(row[11]) and str(row[11]).strip() != '' else 'NULL',
-                # 'avg_crown_volume_m3': row[12] if pd.notna(row[12]) and str(row[12]).strip() != '' else 'NULL'
-            }
-            
-            sql = f"""
-            INSERT INTO tree_db.tree_type (
-                type_id, greek_name, scientific_name, 
-                amount
-            )
-            VALUES (
-                {row[0]},
-                '{greek_name}',
-                '{scientific_name}',
-                {values['md3']}
-            );
-            """
-            sql_commands.append(sql)
-            
-        except Exception as e:
-            print(f"Error processing row {index}: {e}")
-            print(f"Row data: {row}")
-            continue
-    
-    return sql_commands
+    with open(os.path.join(folder, 'species.json'), 'w', encoding='utf-8') as file:
+        json.dump([{'id': id_value, 'greek_name': greek_name} for greek_name, id_value in species], file, ensure_ascii=False)
+    with open(os.path.join(folder, 'locations.json'), 'w', encoding='utf-8') as file:
+        json.dump([
+            {'id': id_value, 'tax_code': key[0], 'street_id': key[1], 'street_name': key[2], 'street_number': key[3]}
+            for key, id_value in locations
+        ], file, ensure_ascii=False)
+    with open(os.path.join(folder, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump({
+            'count': len(df),
+            'columns': {name: {'file': f"{name}.bin", 'dtype': dtype} for name, dtype in TREE_COLUMNS.items()},
+            'dictionaries': {'type': 'species.json', 'location': 'locations.json'}
+        }, file, indent=2)
+    print(f"Tree columns exported to {folder}")
 
 
-def read_locations_data(excel_file):
-    """Read locations data from Excel and generate SQL insert commands"""
-    # Read Excel without headers
-    df = pd.read_excel(excel_file, header=None)
-    sql_commands = []
-    
-    # Skip header row
-    df = df.iloc[1:]
-    
-    # Create a set of unique locations using relevant columns
-    unique_locations = {}  # Changed to dictionary to store all numbers for each street
-    for index, row in df.iterrows():
-        try:
-            # Clean and prepare values
-            # Handle tax_code - convert to '0' if not a valid postal code
-            tax_code = str(row[1]).strip() if pd.notna(row[1]) else '0'
-            if tax_code == '':
-                tax_code = '0'
-            else:
-                # Remove spaces and try to convert to int
-                try:
-                    int(tax_code.replace(' ', ''))
-                except ValueError:
-                    tax_code = '0'
-                
-            street_id = str(row[2]).strip() if pd.notna(row[2]) else ''  # odos_id (column C)
-            street_name = re.sub(r'\s+', ' ', str(row[3])).strip() if pd.notna(row[3]) else ''  # onoma (column D)
-            
-            # Handle street_number - keep as string, convert empty or '-' to NULL
-            street_number = str(row[4]).strip() if pd.notna(row[4]) else '0'
-            if street_number == '-' or street_number == '':
-                street_number = '0'
-            street_number = f"'{street_number}'"  # Wrap in quotes for varchar
-                
-            area_id = int(float(row[5])) if pd.notna(row[5]) else 0  # dimotiko_diamerismo (column F)
-            
-            # Skip if essential fields are empty
-            if not all([tax_code, street_id, street_name]):
-                continue
-                
-            # Create key for uniqueness check (without street number)
-            location_key = (tax_code, street_id, street_name)
-            
-            # Add to dictionary if it's a new street or update numbers if it exists
-            if location_key not in unique_locations:
-                unique_locations[location_key] = {
-                    'area_id': area_id,
-                    'numbers': set([street_number]) if street_number else set()
-                }
-            else:
-                if street_number:
-                    unique_locations[location_key]['numbers'].add(street_number)
-        except Exception as e:
-            print(f"Error processing row {index}: {e}")
-            print(f"Row data: {row}")
-            continue
-    
-    # Generate SQL commands for unique locations
-    for (tax_code, street_id, street_name), data in unique_locations.items():
-        # Create one entry without number if no numbers exist
-        if not data['numbers']:
-            sql = f"""
-            INSERT INTO tree_db.location (
-                tax_code, street_id, street_name, street_number, area_id
-            )
-            VALUES (
-                '{tax_code}',
-                '{street_id}',
-                '{street_name}',
-                NULL,
-                {data['area_id']}
-            );
-            """
-            sql_commands.append(sql)
-        else:
-            # Create one entry for each unique number
-            for number in data['numbers']:
-                sql = f"""
-                INSERT INTO tree_db.location (
-                    tax_code, street_id, street_name, street_number, area_id
-                )
-                VALUES (
-                    '{tax_code}',
-                    '{street_id}',
-                    '{street_name}',
-                    {number},
-                    {data['area_id']}
-                );
-                """
-                sql_commands.append(sql)
-                
-    print(f"Found {len(unique_locations)} unique streets with {sum(len(data['numbers']) for data in unique_locations.values())} total addresses")
-    return sql_commands
-
-
-def read_trees_data(excel_file):
-    """Read trees data from Excel and generate SQL insert commands"""
-    # Read Excel without headers
-    df = pd.read_excel(excel_file, header=None)
-    sql_commands = []
-    
-    # Skip header row
-    df = df.iloc[1:]
-    
-    for index, row in df.iterrows():
-        try:
-            # Skip row if essential data is missing
-            # if pd.isna(row[7]) or pd.isna(row[8]) or pd.isna(row[9]) or pd.isna(row[10]):  # lat/lon coordinates
-            #     continue
-                
-            # Get location components for foreign key reference
-            # Handle tax_code - convert to '0' if not a valid postal code
-            tax_code = str(row[1]).strip() if pd.notna(row[1]) else '0'
-            if tax_code == '':
-                tax_code = '0'
-            else:
-                # Remove spaces and try to convert to int
-                try:
-                    int(tax_code.replace(' ', ''))
-                except ValueError:
-                    tax_code = '0'
-                    
-            street_id = str(row[2]).strip() if pd.notna(row[2]) else ''  # odos_id (column C)
-            street_name = re.sub(r'\s+', ' ', str(row[3])).strip() if pd.notna(row[3]) else ''  # onoma (column D)
-            
-            # Handle street_number - keep as string, convert empty or '-' to NULL
-            street_number = str(row[4]).strip() if pd.notna(row[4]) else '0'
-            if street_number == '-' or street_number == '':
-                street_number = '0'
-            street_number = f"'{street_number}'"  # Wrap in quotes for varchar
-            
-            # Clean common_name
-            common_name = re.sub(r'\s+', ' ', str(row[7])).strip() if pd.notna(row[7]) else ''
-            
-            sql = f"""
-            SET @type_id = (
-                SELECT COALESCE(
-                    (SELECT tt.id FROM tree_db.tree_type tt WHERE tt.greek_name = '{common_name}' LIMIT 1),
-                    (SELECT tt.id FROM tree_db.tree_type tt WHERE tt.greek_name = '_ΑΓΝΩΣΤΟ ΕΙΔΟΣ_' LIMIT 1)
-                )
-            );
-            SET @location_id = (SELECT l.id FROM tree_db.location l WHERE l.tax_code = '{tax_code}' AND l.street_id = '{street_id}' AND l.street_name = '{street_name}' AND l.street_number = {street_number} LIMIT 1);
-            INSERT INTO tree_db.tree (
-                type_code, name, absolute_position_x, absolute_position_y,
-                lat, lon, location_id
-            )VALUES(
-                @type_id,
-                '{common_name}',
-                {row[8]},
-                {row[9]},
-                {row[10]},
-                {row[11]},
-                @location_id
-            );
-            """
-            sql_commands.append(sql)
-            
-        except Exception as e:
-            print(f"Error processing row {index}: {e}")
-            print(f"Row data: {row}")
-            continue
-    
-    return sql_commands
+def read_tree_columns(folder=TREE_COLUMNS_DIR):
+    """Return the memory-mapped columns written by export_tree_columns by name"""
+    with open(os.path.join(folder, 'manifest.json'), encoding='utf-8') as file:
+        manifest = json.load(file)
+    return {
+        name: np.memmap(os.path.join(folder, column['file']), dtype=column['dtype'], mode='r', shape=(manifest['count'],))
+        if manifest['count'] else np.empty(0, column['dtype'])
+        for name, column in manifest['columns'].items()
+    }
 
 
-def import_data_to_db(sql_commands):
-    """Import data to MySQL database"""
+def bump_data_version():
+    """Increment the data version, invalidating every snapshot, and return it"""
+    connection = connect_db()
     try:
-        connection = mysql.connector.connect(
-            host='localhost',
-            user='root',  # replace with your MySQL username
-            password='',  # replace with your MySQL password
-            database='tree_db',
-            allow_local_infile=True
-        )
-        
         cursor = connection.cursor()
-
-        for command in sql_commands:
-            # Split commands if they contain multiple statements
-            for statement in command.split(';'):
-                if statement.strip():  # Skip empty statements
-                    cursor.execute(statement + ';')
-            connection.commit()  # Commit after each complete command
-            
-        print("Data imported successfully!")
-        
-    except mysql.connector.Error as error:
-        print(f"Failed to import data into MySQL table: {error}")
-        
+        cursor.execute(DATA_VERSION_DDL)
+        cursor.execute(
+            "INSERT INTO tree_db.data_version (id, version, updated_at) VALUES (1, 1, NOW()) "
+            "ON DUPLICATE KEY UPDATE version = version + 1, updated_at = NOW()"
+        )
+        cursor.execute("SELECT version FROM tree_db.data_version WHERE id = 1")
+        version = cursor.fetchone()[0]
+        connection.commit()
+        cursor.close()
     finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-            print("MySQL connection closed")
+        connection.close()
+    return version
+
 
 def delete_all_data():
-    """Delete all data from all tables"""
+    """Delete all data from all tables
+
+    The content hashes and the checkpoints of the inputs are forgotten as
+    well, so the next import loads everything again, and the data version is
+    bumped so the API drops its snapshots.
+    """
+    connection = None
     try:
-        connection = mysql.connector.connect(
-            host='localhost',
-            user='root',    
-            password='',
-            database='tree_db'
-        )
+        connection = connect_db()
         
         cursor = connection.cursor()    
         
         # Delete all data from all tables
-        for table in ['tree', 'location', 'tree_type', 'polution', 'meteo_station']:
+        cursor.execute(POLLUTION_ROLLUP_DDL)
+        cursor.execute(TREE_CLUSTER_DDL)
+        cursor.execute(TREE_STATION_DDL)
+        cursor.execute(AREA_STATS_DDL)
+        cursor.execute(IMPORT_STATE_DDL)
+        cursor.execute(IMPORT_CHECKPOINT_DDL)
+        for table in ['import_checkpoint', 'import_state', 'area_stats', 'tree_station', 'tree_cluster', 'tree', 'location', 'tree_type', 'polution_daily', 'polution', 'meteo_station']:
             cursor.execute(f"DELETE FROM {table}")
         connection.commit()
+        bump_data_version()
         
         print("All data deleted successfully!")
     
@@ -519,73 +2143,750 @@ def delete_all_data():
         print(f"Failed to delete data from MySQL table: {error}")
         
     finally:
-        if connection.is_connected():
+        if connection is not None and connection.is_connected():
             cursor.close()
             connection.close()
             print("MySQL connection closed")
             
 
-def export_sql_commands(sql_commands, filename='import_data.sql'):
-    """Export SQL commands to a file"""
+def export_sql_commands(records, filename='import_data.sql', upsert=False):
+    """Export the SQL insert command of every record to a file
+
+    This is a generator that passes the records on after writing them, so a
+    reader can be exported and imported in a single pass, e.g.
+    import_data_to_db(export_sql_commands(read_tree_types_data(file), 'tree_types.sql'))
+    """
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
     with open(filename, 'w', encoding='utf-8') as file:
-        for command in sql_commands:
-            file.write(command.strip() + '\n')
+        for record in records:
+            file.write(insert_sql([exported_record(record)], upsert=upsert) + '\n')
+            yield record
     print(f"SQL commands exported to {filename}")
 
 
-def main():
-    polution_file = 'Polution.xlsx'
-    copernicus_file1 = 'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_2022.csv'
-    copernicus_file2 = 'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_2023.csv'
-    copernicus_file3 = 'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_2024.csv'
-    trees_file = 'Trees.xlsx'
-    tree_type_file = 'trees_thess_0_1_1.csv'
-    
-    # Read data and generate SQL commands
-    meteo_stations_commands = read_meteo_stations_data(polution_file)
-    pollution_commands = read_pollution_data(polution_file)
-    pollution_copernicus_commands = read_pollution_copernicus_data(copernicus_file1)
-    pollution_copernicus_commands2 = read_pollution_copernicus_data(copernicus_file2)
-    pollution_copernicus_commands3 = read_pollution_copernicus_data(copernicus_file3)
-    tree_types_commands = read_tree_types_data(tree_type_file)
-    locations_commands = read_locations_data(trees_file)
-    trees_commands = read_trees_data(trees_file)
-    
-    # Combine all SQL commands - note the order is important for foreign keys
-    all_commands = (meteo_stations_commands + pollution_commands + 
-                   tree_types_commands + locations_commands + trees_commands)
-    
-    # Export individual files
-    export_sql_commands(meteo_stations_commands, 'insert_db/meteo_stations_data.sql')
-    export_sql_commands(pollution_commands, 'insert_db/pollution_data.sql')
-    #Copernicus pollution data
-    export_sql_commands(pollution_copernicus_commands, 'insert_db/pollution_copernicus_data.sql')
-    export_sql_commands(pollution_copernicus_commands2, 'insert_db/pollution_copernicus_data2.sql')
-    export_sql_commands(pollution_copernicus_commands3, 'insert_db/pollution_copernicus_data3.sql')
-
-    export_sql_commands(tree_types_commands, 'insert_db/tree_types_data.sql')
-    export_sql_commands(locations_commands, 'insert_db/locations_data.sql')
-    export_sql_commands(trees_commands, 'insert_db/trees_data.sql')
-    # export_sql_commands(all_commands, 'import_data.sql')
-
-    #import data to db
-    import_data_to_db(meteo_stations_commands)
-    print("meteo_stations_commands imported")
-    import_data_to_db(pollution_commands)
-    print("pollution_commands imported")
-    import_data_to_db(pollution_copernicus_commands)
-    import_data_to_db(pollution_copernicus_commands2)
-    import_data_to_db(pollution_copernicus_commands3)
-    print("pollution_copernicus_commands imported")
-    import_data_to_db(tree_types_commands)  
-    print("tree_types_commands imported")
-    import_data_to_db(locations_commands)
-    print("locations_commands imported")
-    import_data_to_db(trees_commands)
-    print("trees_commands imported")
+def open_shard(path, mode, compression=SQL_DUMP_COMPRESSION):
+    """Open a dump shard as text, mode is 'r' or 'w'"""
+    if compression == 'zstd':
+        import zstandard
+        if mode == 'w':
+            return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, 'wb')), encoding='utf-8')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    return gzip.open(path, f"{mode}t", encoding='utf-8')
 
 
+def export_sql_dump(records, folder, upsert=False, chunk_size=SQL_DUMP_CHUNK_SIZE,
+                    shard_chunks=SQL_DUMP_SHARD_CHUNKS, compression=SQL_DUMP_COMPRESSION):
+    """Export the records as a dump of compressed shards, see replay_sql_dump
 
-if __name__ == "__main__":
-    main()
+    Every chunk_size records are one multi-row INSERT in a transaction of
+    its own, every shard_chunks INSERTs a numbered shard <folder>/<name>.0001.sql.gz
+    (.sql.zst with zstd) that replays on its own connection. Lookups of
+    foreign keys are run once per shard into session variables. The shards
+    are listed in <folder>/manifest.json. Like export_sql_commands this is a
+    generator that passes the records on.
+    """
+    os.makedirs(folder, exist_ok=True)
+    for path in glob.glob(os.path.join(folder, '*.sql.*')):
+        os.remove(path)
+
+    name = os.path.basename(os.path.normpath(folder))
+    shards = []
+    file = None
+    try:
+        for batch in batch_records(records, chunk_size):
+            if file is None or shards[-1]['chunks'] == shard_chunks:
+                if file is not None:
+                    file.close()
+                shards.append({
+                    'file': f"{name}.{len(shards) + 1:04d}{SQL_DUMP_SUFFIXES[compression]}",
+                    'table': TABLES[type(batch[0])], 'rows': 0, 'chunks': 0
+                })
+                file = open_shard(os.path.join(folder, shards[-1]['file']), 'w', compression)
+                variables = {}
+
+            rows = [exported_record(record) for record in batch]
+            for value in dict.fromkeys(value for record in rows for value in record if isinstance(value, SqlExpression)):
+                if value not in variables:
+                    variables[value] = SqlExpression(f"@fk{len(variables) + 1}")
+                    file.write(f"SET {variables[value]} = {value};\n")
+            rows = [record._replace(**{
+                field: variables[value] for field, value in record._asdict().items() if isinstance(value, SqlExpression)
+            }) for record in rows]
+            file.write(f"START TRANSACTION;\n{insert_sql(rows, upsert=upsert)}\nCOMMIT;\n")
+
+            shards[-1]['rows'] += len(batch)
+            shards[-1]['chunks'] += 1
+            yield from batch
+    finally:
+        if file is not None:
+            file.close()
+
+    with open(os.path.join(folder, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump({
+            'compression': compression,
+            'rows': sum(shard['rows'] for shard in shards),
+            'shards': shards
+        }, file, indent=2)
+    print(f"SQL dump of {len(shards)} shards exported to {folder}")
+
+
+def export_sql(records, sql_file, upsert=False):
+    """Export the records in the SQL_EXPORT_FORMAT, a dump goes to the folder named like sql_file"""
+    if SQL_EXPORT_FORMAT == 'dump':
+        return export_sql_dump(records, os.path.splitext(sql_file)[0], upsert)
+    return export_sql_commands(records, sql_file, upsert)
+
+
+def read_shard(path, compression=SQL_DUMP_COMPRESSION):
+    """Yield the statements of a dump shard, without their semicolons
+
+    Every statement is a line of its own: export_sql_dump writes one per
+    line and sql_literal escapes the line breaks in the values.
+    """
+    with open_shard(path, 'r', compression) as file:
+        for line in file:
+            yield line.rstrip('\n').rstrip(';')
+
+
+def replay_shard(path, compression=SQL_DUMP_COMPRESSION):
+    """Run the statements of a dump shard on one connection, returns the number of transactions
 
+    A transaction failing with a transient error is run again on a new
+    connection, after the session variables of the shard are set again.
+    """
+    connection = cursor = None
+    session = []
+
+    def reconnect():
+        nonlocal connection, cursor
+        if connection is not None:
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+        connection = connect_db()
+        cursor = connection.cursor()
+        for statement in session:
+            cursor.execute(statement)
+
+    def run(statements):
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        except mysql.connector.Error:
+            reconnect()
+            raise
+
+    transactions = 0
+    try:
+        reconnect()
+        statements = []
+        for statement in read_shard(path, compression):
+            if statement.startswith('SET '):
+                with_retry(run, [statement])
+                session.append(statement)
+                continue
+            statements.append(statement)
+            if statement == 'COMMIT':
+                with_retry(run, statements)
+                statements = []
+                transactions += 1
+    finally:
+        if connection is not None and connection.is_connected():
+            cursor.close()
+            connection.close()
+    return transactions
+
+
+def replay_sql_dump(folders, max_workers=MAX_WORKERS):
+    """Load dumps written by export_sql_dump, the shards of each over parallel connections
+
+    The dumps are loaded one after the other in the given order, so the
+    rows a dump looks up (e.g. the tree types of the trees) must come from
+    an earlier one.
+    """
+    for folder in folders:
+        with open(os.path.join(folder, 'manifest.json'), encoding='utf-8') as file:
+            manifest = json.load(file)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(replay_shard, os.path.join(folder, shard['file']), manifest['compression'])
+                for shard in manifest['shards']
+            ]
+            for future in futures:
+                future.result()
+
+        elapsed = time.perf_counter() - start
+        rate = manifest['rows'] / elapsed if elapsed > 0 else 0
+        print(f"Replayed {folder}: {manifest['rows']} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+
+
+class Stage(NamedTuple):
+    """Step of the import, run by run_stages once the stages it depends on are done
+
+    function is called with the dict of the results of the finished stages.
+    """
+    name: str
+    function: object
+    depends_on: tuple = ()
+
+
+def run_stages(stages, max_workers=MAX_WORKERS, metrics_file=METRICS_FILE, profiler=PROFILER):
+    """Run stages concurrently on a thread pool, respecting only their dependencies
+
+    Stages that depend on a failed stage are skipped. Prints the start,
+    duration and row counts of every stage, writes all their StageMetrics
+    to metrics_file as JSON and returns the dict of stage results. With a
+    profiler (see PROFILER) the stages run one at a time, each under its
+    own profiler, and the profiles are written together at the end.
+    """
+    pending = {stage.name: stage for stage in stages}
+    results = {}
+    failed = set()
+    metrics = {stage.name: StageMetrics(stage.name) for stage in stages}
+    profiles = []
+    running = {}
+    start = time.perf_counter()
+
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed, the stages are not profiled")
+            profiler = None
+    if profiler:
+        max_workers = 1
+
+    def timed(stage):
+        stage_metrics = _current.metrics = metrics[stage.name]
+        stage_metrics.start = time.perf_counter() - start
+        stage_metrics.status = 'running'
+        profile = cProfile.Profile() if profiler == 'cprofile' else Profiler() if profiler else None
+        if profile is not None:
+            profile.enable() if profiler == 'cprofile' else profile.start()
+        try:
+            return stage.function(results)
+        finally:
+            if profile is not None:
+                profile.disable() if profiler == 'cprofile' else profile.stop()
+                profiles.append((stage.name, profile))
+            stage_metrics.seconds = time.perf_counter() - start - stage_metrics.start
+            _current.metrics = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(dependency in failed for dependency in stage.depends_on):
+                    print(f"Skipping stage {name}: a stage it depends on failed")
+                    metrics[name].status = 'skipped'
+                    failed.add(name)
+                    del pending[name]
+                elif all(dependency in results for dependency in stage.depends_on):
+                    running[executor.submit(timed, stage)] = name
+                    del pending[name]
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages with unknown or circular dependencies: {', '.join(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    metrics[name].status = 'done'
+                except Exception as e:
+                    print(f"Stage {name} failed: {e}")
+                    metrics[name].status = 'failed'
+                    metrics[name].error(type(e).__name__, str(e), skipped=False)
+                    failed.add(name)
+
+    elapsed = time.perf_counter() - start
+    ran = sorted((stage for stage in metrics.values() if stage.status != 'skipped'), key=lambda stage: stage.start)
+    print(f"\n{'stage':<30}{'start':>10}{'seconds':>10}{'rows in':>10}{'rows out':>10}{'skipped':>10}{'errors':>8}")
+    for stage in ran:
+        errors = sum(entry['count'] for entry in stage.errors.values())
+        print(
+            f"{stage.name:<30}{stage.start:>10.2f}{stage.seconds:>10.2f}"
+            f"{stage.rows_in:>10}{stage.rows_out:>10}{stage.rows_skipped:>10}{errors:>8}"
+        )
+        for reason, entry in stage.errors.items():
+            print(f"    {reason}: {entry['count']} (e.g. {'; '.join(map(str, entry['samples']))})")
+    print(f"Wall time {elapsed:.2f}s, {sum(stage.seconds for stage in ran):.2f}s of stage time")
+
+    if metrics_file:
+        with open(metrics_file, 'w', encoding='utf-8') as file:
+            json.dump({
+                'wall_seconds': round(elapsed, 3),
+                'stages': [stage.as_dict() for stage in metrics.values()]
+            }, file, ensure_ascii=False, indent=2)
+        print(f"Stage metrics written to {metrics_file}")
+
+    if profiler == 'cprofile' and profiles:
+        pstats.Stats(*(profile for _, profile in profiles)).dump_stats('import.prof')
+        print("Profile written to import.prof")
+    elif profiler and profiles:
+        with open('import_profile.txt', 'w', encoding='utf-8') as file:
+            for name, profile in profiles:
+                file.write(f"Stage {name}\n{profile.output_text()}\n")
+        print("Profile written to import_profile.txt")
+    return results
+
+
+def copernicus_sql_file(csv_file):
+    """Return the SQL file of a Copernicus file, named after it so that every file has exports of its own"""
+    return f"insert_db/pollution_copernicus_{os.path.splitext(os.path.basename(csv_file))[0]}.sql"
+
+
+def import_stages(polution_file, copernicus_files, trees_file, tree_type_file, parser=None,
+                  incremental=False):
+    """Return the stages that import every dataset
+
+    The only dependencies are the real ones: the readers of an Excel file need
+    it parsed, pollution rows need the station ids and trees need the tree type
+    and location ids. Everything else runs concurrently over its own
+    connection. With a parser (a ProcessPoolExecutor) the sheets of the Excel
+    files are parsed in parallel processes. The locations and trees of
+    Trees.xlsx are read in one pass (see read_trees_file).
+
+    With incremental, inputs (files, and the sheets of Polution.xlsx) whose
+    content hash matches their last import are skipped and the rest are
+    loaded as upserts. The upsert keys must exist (see ensure_upsert_keys).
+    Either way the daily pollution rollups and the pollution archive of the
+    loaded inputs are updated and the tree clusters and packed tree columns
+    are rebuilt when the trees are loaded. The nearest stations of the trees and the area aggregates
+    are recomputed last (see import_spatial_join).
+    """
+    def parse_trees(results):
+        read_sheets(trees_file, executor=parser)
+        return read_trees_file(trees_file)
+
+    def import_meteo_stations(results):
+        import_dataset(
+            read_meteo_stations_data(polution_file), 'insert_db/meteo_stations_data.sql', incremental, [polution_file]
+        )
+        return load_id_map('meteo_station', ['name'])
+
+    def import_pollution(results):
+        source = f"polution:{os.path.basename(polution_file)}"
+        sheets = read_sheets(polution_file)
+        sheet_names = list(sheets)[1:]
+        if incremental:
+            content_hash = file_hash(polution_file)
+            if stored_hash(source) == content_hash:
+                print(f"Skipping {source}: unchanged since the last import")
+                return
+            sheet_hashes = {sheet_name: sheet_hash(sheets[sheet_name]) for sheet_name in sheet_names}
+            sheet_names = [
+                sheet_name for sheet_name in sheet_names
+                if stored_hash(f"{source}#{sheet_name}") != sheet_hashes[sheet_name]
+            ]
+
+        days = set()
+        import_dataset(
+            collect_rollups(archive_pollution(
+                read_pollution_data(polution_file, results['meteo_station'], sheet_names), 'pollution_data',
+                partial=incremental
+            ), days),
+            'insert_db/pollution_data.sql', incremental, [polution_file]
+        )
+        import_rollups(days, rollup_file('insert_db/pollution_data.sql'))
+
+        if incremental:
+            for sheet_name in sheet_names:
+                record_import(f"{source}#{sheet_name}", sheet_hashes[sheet_name])
+            record_import(source, content_hash)
+
+    def import_tree_types(results):
+        import_if_changed(
+            f"tree_type:{os.path.basename(tree_type_file)}", [tree_type_file],
+            lambda: import_dataset(
+                read_tree_types_data(tree_type_file), 'insert_db/tree_types_data.sql', incremental, [tree_type_file]
+            ),
+            incremental
+        )
+        return load_id_map('tree_type', ['greek_name'])
+
+    def import_locations(results):
+        import_if_changed(
+            f"location:{os.path.basename(trees_file)}", [trees_file],
+            lambda: import_dataset(
+                iter(results['parse trees'][0]), 'insert_db/locations_data.sql', incremental, [trees_file]
+            ),
+            incremental
+        )
+        return load_id_map('location', ['tax_code', 'street_id', 'street_name', 'street_number'])
+
+    def import_trees(results):
+        import_if_changed(
+            f"tree:{os.path.basename(trees_file)}", [trees_file, tree_type_file],
+            lambda: import_dataset(
+                tree_records(*results['parse trees'], results['tree_type'], results['location'], results['species']),
+                'insert_db/trees_data.sql', incremental, [trees_file, tree_type_file]
+            ),
+            incremental
+        )
+        # Rebuilt on every run from the table, which also holds the trees added through the site
+        trees = load_trees()
+        import_tree_clusters(trees, 'insert_db/tree_clusters_data.sql')
+        export_tree_columns(trees, results['tree_type'], results['location'])
+
+    def import_copernicus(csv_file, sql_file, results):
+        import_if_changed(
+            f"polution:{os.path.basename(csv_file)}", [csv_file],
+            lambda: import_copernicus_data(csv_file, results['meteo_station'], sql_file, upsert=incremental),
+            incremental
+        )
+
+    stages = [
+        Stage('parse polution', lambda results: read_sheets(polution_file, executor=parser)),
+        Stage('parse trees', parse_trees),
+        Stage('meteo_station', import_meteo_stations, ('parse polution',)),
+        Stage('polution', import_pollution, ('meteo_station',)),
+        Stage('tree_type', import_tree_types),
+        Stage('location', import_locations, ('parse trees',)),
+        Stage('species', lambda results: SpeciesIndex(read_tree_types_data(tree_type_file))),
+        Stage('tree', import_trees, ('parse trees', 'tree_type', 'location', 'species')),
+    ]
+
+    #Copernicus pollution data, one stage per file
+    for number, csv_file in enumerate(copernicus_files, start=1):
+        sql_file = copernicus_sql_file(csv_file)
+        stages.append(Stage(
+            f'copernicus {number}',
+            lambda results, csv_file=csv_file, sql_file=sql_file: import_copernicus(csv_file, sql_file, results),
+            ('meteo_station',)
+        ))
+
+    # Nearest stations and area aggregates, once the trees and every pollution series are in
+    stages.append(Stage(
+        'spatial join',
+        lambda results: import_spatial_join(tree_type_file, 'insert_db/tree_stations_data.sql'),
+        ('tree', 'polution', *(stage.name for stage in stages if stage.name.startswith('copernicus')))
+    ))
+
+    return stages
+
+
+# Environment variables of the command line options, e.g. TREEMAPPER_DB_PASSWORD
+ENV_PREFIX = 'TREEMAPPER_'
+
+# Input files of a full import, relative to the data folder
+INPUT_FILES = {
+    'polution_file': 'Polution.xlsx',
+    'copernicus_files': [
+        'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_2022.csv',
+        'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_2023.csv',
+        'municipality_of_Thessaloniki_pollutants_conc_timeseries-yearly_2024.csv'
+    ],
+    'trees_file': 'Trees.xlsx',
+    'tree_type_file': 'trees_thess_0_1_1.csv'
+}
+
+# Import stage of every dataset of the command line (see import_stages),
+# copernicus stands for the stages of all Copernicus files
+DATASET_STAGES = {
+    'meteo_stations': 'meteo_station',
+    'pollution': 'polution',
+    'copernicus': 'copernicus',
+    'tree_types': 'tree_type',
+    'locations': 'location',
+    'trees': 'tree',
+    'spatial': 'spatial join'
+}
+
+# Stages whose id maps are read from the database when a loaded stage needs
+# them but they are not loaded themselves, as (table, key columns)
+ID_MAP_STAGES = {
+    'meteo_station': ('meteo_station', ['name']),
+    'tree_type': ('tree_type', ['greek_name']),
+    'location': ('location', ['tax_code', 'street_id', 'street_name', 'street_number'])
+}
+
+# Stages that only read input files, run whenever a loaded stage needs them
+INPUT_STAGES = ('parse polution', 'parse trees', 'species')
+
+# Lazily imported modules every command uses, loaded before its threads start
+COMMAND_MODULES = {
+    'import': ('pandas', 'mysql.connector'),
+    'load': ('pandas', 'mysql.connector'),
+    'parse': ('pandas',),
+    'export': ('pandas',),
+    'verify': ('pandas', 'mysql.connector'),
+    'replay': ('mysql.connector',)
+}
+
+# Row count of the table of every dataset, compared with the input by verify
+VERIFY_QUERIES = {
+    'meteo_stations': "SELECT COUNT(*) FROM tree_db.meteo_station",
+    'pollution': "SELECT COUNT(*) FROM tree_db.polution p JOIN tree_db.meteo_station ms ON p.station_id = ms.id "
+                 f"WHERE ms.name <> {sql_literal(COPERNICUS_STATION)}",
+    'copernicus': "SELECT COUNT(*) FROM tree_db.polution p JOIN tree_db.meteo_station ms ON p.station_id = ms.id "
+                  f"WHERE ms.name = {sql_literal(COPERNICUS_STATION)}",
+    'tree_types': "SELECT COUNT(*) FROM tree_db.tree_type",
+    'locations': "SELECT COUNT(*) FROM tree_db.location",
+    'trees': "SELECT COUNT(*) FROM tree_db.tree"
+}
+
+
+def stage_named(name, names):
+    """Return True if a stage is one of names, or a numbered stage like 'copernicus 2' of 'copernicus'"""
+    return any(name == prefix or name.startswith(f"{prefix} ") for prefix in names)
+
+
+def select_stages(stages, names):
+    """Return the stages that load the named stages and what they need
+
+    Stages that are not named but needed only read what was loaded before:
+    the id maps of ID_MAP_STAGES from the database, the rest do nothing,
+    except INPUT_STAGES, which run as they are. A name matches the stage of
+    that name and numbered stages like 'copernicus 2' of 'copernicus'.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    selected = {}
+
+    def visit(name):
+        if name in selected:
+            return
+        stage = by_name[name]
+        if not stage_named(name, names) and name not in INPUT_STAGES:
+            if name in ID_MAP_STAGES:
+                stage = Stage(name, lambda results, table_keys=ID_MAP_STAGES[name]: load_id_map(*table_keys))
+            else:
+                stage = Stage(name, lambda results: None)
+        for dependency in stage.depends_on:
+            visit(dependency)
+        selected[name] = stage
+
+    for stage in stages:
+        if stage_named(stage.name, names):
+            visit(stage.name)
+    return list(selected.values())
+
+
+def run_import(stage_names=None, incremental=INCREMENTAL_IMPORT, bulk_load=BULK_LOAD, max_workers=MAX_WORKERS,
+               profiler=PROFILER, files=INPUT_FILES):
+    """Import the datasets of stage_names (see select_stages), all of them if None
+
+    Returns True if every stage finished.
+    """
+    ensure_columns()
+    if incremental:
+        ensure_upsert_keys()
+    if bulk_load:
+        drop_indexes()
+
+    # Every dataset is read, exported and imported in a single pass, the
+    # datasets that do not depend on each other at the same time
+    failed = True
+    try:
+        with ProcessPoolExecutor(max_workers, multiprocessing.get_context(PARSER_START_METHOD)) as parser:
+            stages = import_stages(
+                files['polution_file'], files['copernicus_files'], files['trees_file'], files['tree_type_file'],
+                parser, incremental
+            )
+            loads = [
+                stage.name for stage in stages
+                if stage.name not in INPUT_STAGES and (stage_names is None or stage_named(stage.name, stage_names))
+            ]
+            if stage_names is not None:
+                stages = select_stages(stages, stage_names)
+            results = run_stages(stages, max_workers, profiler=profiler)
+
+        # Once something was loaded the snapshots of the API responses are stale
+        if any(name in results for name in loads):
+            bump_data_version()
+
+        # Once every stage finished the next import starts over, otherwise it
+        # resumes the imports of this one from their checkpoints
+        if len(results) == len(stages):
+            clear_checkpoints()
+        failed = False
+        return len(results) == len(stages)
+    finally:
+        # Indexes dropped for a bulk load are rebuilt even if a stage failed,
+        # without hiding the error that stopped the import; otherwise they
+        # are only checked, so an import runs no DDL
+        try:
+            if bulk_load:
+                ensure_indexes()
+            else:
+                check_indexes()
+        except (mysql.connector.Error, RuntimeError) as error:
+            if not failed:
+                raise
+            print(f"Failed to {'rebuild' if bulk_load else 'check'} the indexes: {error}")
+
+
+def read_species_index(tree_type_file):
+    """Return the SpeciesIndex of a tree types file, leaving its rows out of the metrics of the stage
+
+    The tree types are the rows of their own dataset, a stage reading trees
+    only matches the tree names to them.
+    """
+    metrics = stage_metrics()
+    _current.metrics = StageMetrics('species')
+    try:
+        return SpeciesIndex(read_tree_types_data(tree_type_file))
+    finally:
+        _current.metrics = metrics
+
+
+def dataset_inputs(dataset, files=INPUT_FILES):
+    """Return (reader, SQL file) pairs of a dataset, reader() yielding its records without a database
+
+    Foreign keys are lookups (see foreign_key), tree names are matched to
+    the tree types of the tree types file.
+    """
+    if dataset == 'copernicus':
+        return [
+            (lambda csv_file=csv_file: read_pollution_copernicus_data(csv_file), copernicus_sql_file(csv_file))
+            for csv_file in files['copernicus_files']
+        ]
+    return [{
+        'meteo_stations': (lambda: read_meteo_stations_data(files['polution_file']), 'insert_db/meteo_stations_data.sql'),
+        'pollution': (lambda: read_pollution_data(files['polution_file']), 'insert_db/pollution_data.sql'),
+        'tree_types': (lambda: read_tree_types_data(files['tree_type_file']), 'insert_db/tree_types_data.sql'),
+        'locations': (lambda: read_locations_data(files['trees_file']), 'insert_db/locations_data.sql'),
+        'trees': (
+            lambda: read_trees_data(files['trees_file'], species=read_species_index(files['tree_type_file'])),
+            'insert_db/trees_data.sql'
+        )
+    }[dataset]]
+
+
+def verify_dataset(dataset, files=INPUT_FILES):
+    """Compare the records of a dataset's input with the rows of its table, returns True if they match"""
+    records = sum(sum(1 for _ in reader()) for reader, _ in dataset_inputs(dataset, files))
+    connection = connect_db()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(VERIFY_QUERIES[dataset])
+        rows = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        connection.close()
+
+    print(f"{dataset}: {records} input records, {rows} table rows{'' if rows == records else ' MISMATCH'}")
+    return rows == records
+
+
+def environment(name, default=None):
+    """Return the value of the environment variable of a command line option"""
+    return os.environ.get(f"{ENV_PREFIX}{name.upper()}", default)
+
+
+def parse_arguments(argv=None):
+    """Parse the command line, options not given default to their environment variable"""
+    datasets = [dataset for dataset in DATASET_STAGES if dataset != 'spatial']
+    parser = argparse.ArgumentParser(
+        description="Import the tree and pollution datasets into the tree_db database. "
+                    f"Every option defaults to the environment variable {ENV_PREFIX}<OPTION>, "
+                    f"e.g. {ENV_PREFIX}DB_PASSWORD."
+    )
+    parser.add_argument('--data-dir', default=environment('data_dir', '.'),
+                        help="folder of the input files and of insert_db (default: current folder)")
+    parser.add_argument('--polution-file', default=environment('polution_file', INPUT_FILES['polution_file']))
+    parser.add_argument('--copernicus-files', nargs='+',
+                        default=environment('copernicus_files', os.pathsep.join(INPUT_FILES['copernicus_files']))
+                        .split(os.pathsep),
+                        help=f"Copernicus CSV files ({os.pathsep}-separated in the environment)")
+    parser.add_argument('--trees-file', default=environment('trees_file', INPUT_FILES['trees_file']))
+    parser.add_argument('--tree-type-file', default=environment('tree_type_file', INPUT_FILES['tree_type_file']))
+    parser.add_argument('--db-host', default=environment('db_host', DB_CONFIG['host']))
+    parser.add_argument('--db-port', type=int, default=environment('db_port'))
+    parser.add_argument('--db-user', default=environment('db_user', DB_CONFIG['user']))
+    parser.add_argument('--db-password', default=environment('db_password', DB_CONFIG['password']))
+    parser.add_argument('--db-name', default=environment('db_name', DB_CONFIG['database']))
+    parser.add_argument('--workers', type=int, default=int(environment('workers', MAX_WORKERS)),
+                        help="stages run at the same time and processes parsing Excel sheets")
+    # Options of the import command, which runs when no command is given
+    parser.set_defaults(incremental=INCREMENTAL_IMPORT, bulk_load=BULK_LOAD, profiler=PROFILER, format=SQL_EXPORT_FORMAT)
+    commands = parser.add_subparsers(dest='command')
+
+    for name, help_text in [('import', "load every dataset (the default)"),
+                            ('load', "load some datasets, reading the ids of the others from the database")]:
+        command = commands.add_parser(name, help=help_text)
+        if name == 'load':
+            command.add_argument('datasets', nargs='+', choices=list(DATASET_STAGES))
+        command.add_argument('--incremental', action='store_true', default=INCREMENTAL_IMPORT,
+                             help="skip unchanged inputs and upsert the rest")
+        command.add_argument('--bulk-load', action='store_true', default=BULK_LOAD,
+                             help="drop the secondary indexes during the load")
+        command.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default=PROFILER)
+        command.add_argument('--format', choices=['dump', 'sql'], default=SQL_EXPORT_FORMAT,
+                             help="format of the exported SQL")
+
+    command = commands.add_parser('parse', help="read datasets and report their metrics, without a database")
+    command.add_argument('datasets', nargs='+', choices=datasets)
+    command = commands.add_parser('export', help="write the SQL of datasets, without a database")
+    command.add_argument('datasets', nargs='+', choices=datasets)
+    command.add_argument('--format', choices=['dump', 'sql'], default=SQL_EXPORT_FORMAT)
+    command = commands.add_parser('verify', help="compare the records of inputs with the rows of their tables")
+    command.add_argument('datasets', nargs='+', choices=datasets)
+    command = commands.add_parser('replay', help="load SQL dumps written by export, in the given order")
+    command.add_argument('folders', nargs='+')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run a command line (see parse_arguments), returns the exit status"""
+    global SQL_EXPORT_FORMAT, BULK_LOAD, MAX_WORKERS
+    args = parse_arguments(argv)
+    os.chdir(args.data_dir)
+    DB_CONFIG.update(host=args.db_host, user=args.db_user, password=args.db_password, database=args.db_name)
+    if args.db_port is not None:
+        DB_CONFIG['port'] = args.db_port
+    files = {
+        'polution_file': args.polution_file,
+        'copernicus_files': args.copernicus_files,
+        'trees_file': args.trees_file,
+        'tree_type_file': args.tree_type_file
+    }
+    command = args.command or 'import'
+    SQL_EXPORT_FORMAT = args.format
+    # connect_db turns the foreign key checks off for a bulk load
+    BULK_LOAD = args.bulk_load
+    # The connection pool is sized for the workers when it is created
+    MAX_WORKERS = args.workers
+    load_modules(*COMMAND_MODULES[command])
+
+    if command == 'replay':
+        replay_sql_dump(args.folders, args.workers)
+        return 0
+    if command == 'verify':
+        return 0 if all([verify_dataset(dataset, files) for dataset in args.datasets]) else 1
+    if command in ('parse', 'export'):
+        stages = [
+            Stage(
+                f"{command} {dataset}" + (f" {number}" if len(inputs) > 1 else ''),
+                lambda results, reader=reader, sql_file=sql_file: sum(
+                    1 for _ in (export_sql(reader(), sql_file) if command == 'export' else reader())
+                )
+            )
+            for dataset in args.datasets
+            for inputs in [dataset_inputs(dataset, files)]
+            for number, (reader, sql_file) in enumerate(inputs, start=1)
+        ]
+        return 0 if len(run_stages(stages, args.workers)) == len(stages) else 1
+
+    if command == 'import':
+        stage_names = None
+    else:
+        stage_names = [DATASET_STAGES[dataset] for dataset in args.datasets]
+    try:
+        finished = run_import(
+            stage_names, args.incremental, args.bulk_load, args.workers, args.profiler, files
+        )
+    except (mysql.connector.Error, RuntimeError) as error:
+        # RuntimeError comes from ensure_upsert_keys and ensure_indexes
+        print(f"Import failed: {error}")
+        return 1
+    return 0 if finished else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
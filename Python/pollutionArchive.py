@@ -0,0 +1,81 @@
+"""Queries of the pollution archive written by importData.py
+
+The archive holds the hourly pollution series of every station as Parquet
+files partitioned by year and station (year=<year>/station_id=<id>/*.parquet,
+see archive_pollution in importData.py). The files are memory-mapped
+and the filters are pushed down to the scan: partitions outside the years
+and stations asked for are never opened and row groups outside the time
+range are skipped by their statistics. Long-range analytics run on the
+archive without touching the database, e.g.
+
+    from pollutionArchive import query_pollution
+    weekly = query_pollution('2022-01-01', '2025-01-01', ['pm10', 'no2'], resample='W')
+
+Run from Python/Data, like the importer.
+"""
+import pandas as pd
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+# Folder of the archive (POLLUTION_ARCHIVE_DIR of importData.py)
+ARCHIVE_DIR = 'insert_db/pollution_archive'
+
+# Pollutant columns of the archive
+POLLUTANTS = ('so2', 'pm10', 'pm25', 'co', 'no', 'no2', 'o3', 'temperature', 'humidity')
+
+# Resampling intervals by name, any pandas offset alias is accepted as well
+RESAMPLE_RULES = {
+    'hourly': None,
+    'daily': 'D',
+    'weekly': 'W'
+}
+
+
+def open_archive(folder=ARCHIVE_DIR):
+    """Return the archive as a memory-mapped pyarrow dataset"""
+    return ds.dataset(
+        folder, format='parquet', partitioning='hive', filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def archive_filter(start=None, end=None, stations=None):
+    """Return the dataset filter of a time range [start, end) and station ids, None for no filter"""
+    conditions = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions += [ds.field('year') >= start.year, ds.field('datetime') >= start.to_pydatetime()]
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions += [ds.field('year') <= end.year, ds.field('datetime') < end.to_pydatetime()]
+    if stations is not None:
+        conditions.append(ds.field('station_id').isin([int(station_id) for station_id in stations]))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def query_pollution(start=None, end=None, pollutants=None, stations=None, resample=None, folder=ARCHIVE_DIR):
+    """Return the pollution series of a time range [start, end) as a DataFrame
+
+    pollutants defaults to all of POLLUTANTS and stations (meteo_station
+    ids) to every station. The rows are station_id, datetime and a column
+    per pollutant, hourly or averaged per resample interval ('daily',
+    'weekly' or a pandas offset alias) and station.
+    """
+    pollutants = list(pollutants or POLLUTANTS)
+    rule = RESAMPLE_RULES.get(resample, resample)
+    table = open_archive(folder).to_table(
+        columns=['station_id', 'datetime', *pollutants], filter=archive_filter(start, end, stations)
+    )
+    df = table.to_pandas().sort_values(['station_id', 'datetime'], ignore_index=True)
+    if rule is None or df.empty:
+        return df
+
+    return (
+        df.set_index('datetime').groupby('station_id')[pollutants]
+        .resample(rule).mean()
+        .dropna(how='all')
+        .reset_index()
+    )
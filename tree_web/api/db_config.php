@@ -6,6 +6,10 @@ define('DB_USERNAME', 'root');
 define('DB_PASSWORD', '');
 define('DB_NAME', 'tree_db');
 
+// Folder of the response snapshots (see snapshots.php), writable by the web
+// server and outside the document root so they are never served directly
+define('SNAPSHOT_DIR', sys_get_temp_dir() . DIRECTORY_SEPARATOR . 'treemapper_snapshots');
+
 // Create connection
 try {
     $conn = new mysqli(DB_SERVER, DB_USERNAME, DB_PASSWORD, DB_NAME);
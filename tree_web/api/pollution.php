@@ -2,8 +2,19 @@
 header('Content-Type: application/json');
 session_start();
 
+// Time ranges and pollutant types of pollution.html whose responses are snapshotted
+const SNAPSHOT_TIME_RANGES = [7, 30, 90, 365, 1095, 0];
+const SNAPSHOT_POLLUTANTS = ['all', 'pm25', 'pm10', 'no2', 'o3'];
+
+// Seconds a pollution snapshot is served, the time ranges are relative to now
+const POLLUTION_SNAPSHOT_MAX_AGE = 3600;
+
+// Pollutants of the polution_daily rollups written by the importer
+const ROLLUP_POLLUTANTS = ['so2', 'pm10', 'pm25', 'co', 'no', 'no2', 'o3', 'temperature', 'humidity'];
+
 try {
     require_once 'db_config.php';
+    require_once 'snapshots.php';
 
     // Get JSON data from request body
     $json = file_get_contents('php://input');
@@ -26,25 +37,38 @@ function handleGetPollutionData($conn, $data) {
         $timeRange = isset($data['time_range']) ? intval($data['time_range']) : 7;
         $pollutantType = isset($data['pollutant_type']) ? $data['pollutant_type'] : 'all';
 
+        // The options of pollution.html are snapshotted, the data version and
+        // the time of the request decide if a snapshot is still valid
+        $snapshot = in_array($timeRange, SNAPSHOT_TIME_RANGES, true) && in_array($pollutantType, SNAPSHOT_POLLUTANTS, true)
+            ? 'pollution_' . $timeRange . '_' . $pollutantType : null;
+        $version = $snapshot !== null ? dataVersion($conn) : null;
+        if ($snapshot !== null && serveSnapshot($snapshot, $version, POLLUTION_SNAPSHOT_MAX_AGE)) {
+            return;
+        }
+
+        // Read the daily rollups written by the importer when they exist
+        $useRollup = ($pollutantType === 'all' || in_array($pollutantType, ROLLUP_POLLUTANTS, true))
+            && hasPollutionRollup($conn);
+
         // Get pollution data for the map
-        $mapData = getMapData($conn, $timeRange, $pollutantType);
+        $mapData = getMapData($conn, $timeRange, $pollutantType, $useRollup);
         
         // Get timeline data for line chart
-        $timelineData = getTimelineData($conn, $timeRange, $pollutantType);
+        $timelineData = getTimelineData($conn, $timeRange, $pollutantType, $useRollup);
         
         // Get area data for bar chart
-        $areaData = getAreaData($conn, $timeRange, $pollutantType);
+        $areaData = getAreaData($conn, $timeRange, $pollutantType, $useRollup);
         
         // Get distribution data for pie chart
-        $distributionData = getDistributionData($conn, $timeRange);
+        $distributionData = getDistributionData($conn, $timeRange, $useRollup);
         
         // Get trend data for area chart
-        $trendData = getTrendData($conn, $timeRange, $pollutantType);
+        $trendData = getTrendData($conn, $timeRange, $pollutantType, $useRollup);
 
         // Get additional metrics data
-        $additionalMetricsData = getAdditionalMetricsData($conn, $timeRange);
+        $additionalMetricsData = getAdditionalMetricsData($conn, $timeRange, $useRollup);
 
-        echo json_encode([
+        $json = json_encode([
             'success' => true,
             'map_data' => $mapData,
             'timeline_data' => $timelineData,
@@ -53,15 +77,102 @@ function handleGetPollutionData($conn, $data) {
             'trend_data' => $trendData,
             'additional_metrics_data' => $additionalMetricsData
         ]);
+        if ($snapshot !== null) {
+            saveSnapshot($snapshot, $version, $json);
+        }
+        echo $json;
     } catch (Exception $e) {
         echo json_encode(['success' => false, 'message' => 'Failed to fetch pollution data']);
     }
 }
 
-function getMapData($conn, $timeRange, $pollutantType) {
+function hasPollutionRollup($conn) {
+    try {
+        $result = $conn->query("SELECT 1 FROM polution_daily LIMIT 1");
+        return $result && $result->num_rows > 0;
+    } catch (Exception $e) {
+        return false;
+    }
+}
+
+function rollupCondition($timeRange) {
+    return $timeRange > 0 ? "WHERE r.date >= DATE(DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY))" : "WHERE 1 = 1";
+}
+
+// Average of the hourly values of a pollutant over the grouped rollup rows
+function rollupAverage($pollutant) {
+    return "SUM(CASE WHEN r.pollutant = '" . $pollutant . "' THEN r.avg_value * r.value_count END)
+                    / SUM(CASE WHEN r.pollutant = '" . $pollutant . "' THEN r.value_count END)";
+}
+
+// Daily averages of pollutants over all stations, as date and one column per pollutant
+function dailyAveragesSql($timeCondition, $pollutants, $useRollup) {
+    $columns = [];
+    foreach ($pollutants as $pollutant) {
+        $columns[] = ($useRollup ? rollupAverage($pollutant) : "AVG(p." . $pollutant . ")") . " as " . $pollutant;
+    }
+
+    if ($useRollup) {
+        return "SELECT 
+                    r.date as date,
+                    " . implode(",\n                    ", $columns) . "
+                FROM polution_daily r
+                " . $timeCondition . "
+                GROUP BY r.date
+                ORDER BY r.date";
+    }
+    return "SELECT 
+                DATE(p.datetime) as date,
+                " . implode(",\n                ", $columns) . "
+            FROM polution p
+            " . $timeCondition . "
+            GROUP BY DATE(p.datetime)
+            ORDER BY DATE(p.datetime)";
+}
+
+// Daily averages of one pollutant over all stations, as date and avg_value
+function dailyAverageSql($timeCondition, $pollutantType, $useRollup) {
+    if ($useRollup) {
+        return "SELECT 
+                    r.date as date,
+                    " . rollupAverage($pollutantType) . " as avg_value
+                FROM polution_daily r
+                " . $timeCondition . "
+                AND r.pollutant = '" . $pollutantType . "'
+                GROUP BY r.date
+                ORDER BY r.date";
+    }
+    return "SELECT 
+                DATE(p.datetime) as date,
+                AVG(p." . $pollutantType . ") as avg_value
+            FROM polution p
+            " . $timeCondition . "
+            AND p." . $pollutantType . " IS NOT NULL
+            GROUP BY DATE(p.datetime)
+            ORDER BY DATE(p.datetime)";
+}
+
+function getMapData($conn, $timeRange, $pollutantType, $useRollup = false) {
     $timeCondition = $timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "";
 
-    if ($pollutantType === 'all') {
+    if ($useRollup) {
+        // One marker per station, day and pollutant with the daily average
+        $pollutants = $pollutantType === 'all' ? ['pm25', 'pm10', 'no2', 'o3'] : [$pollutantType];
+        $sql = "SELECT 
+                    ms.latitude as lat,
+                    ms.longitude as lon,
+                    r.avg_value as value,
+                    r.date as timestamp,
+                    ms.name as location,
+                    " . ($pollutantType === 'all'
+                        ? "CASE r.pollutant WHEN 'pm25' THEN 'PM2.5' ELSE UPPER(r.pollutant) END"
+                        : "'" . strtoupper($pollutantType) . "'") . " as pollutant
+                FROM polution_daily r
+                JOIN meteo_station ms ON r.station_id = ms.id
+                " . rollupCondition($timeRange) . "
+                AND r.pollutant IN ('" . implode("', '", $pollutants) . "')
+                ORDER BY r.date DESC";
+    } elseif ($pollutantType === 'all') {
         $sql = "SELECT 
                     ms.latitude as lat,
                     ms.longitude as lon,
@@ -138,20 +249,12 @@ function getMapData($conn, $timeRange, $pollutantType) {
     return $data;
 }
 
-function getTimelineData($conn, $timeRange, $pollutantType) {
-    $timeCondition = $timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "";
+function getTimelineData($conn, $timeRange, $pollutantType, $useRollup = false) {
+    $timeCondition = $useRollup ? rollupCondition($timeRange)
+        : ($timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "");
 
     if ($pollutantType === 'all') {
-        $sql = "SELECT 
-                    DATE(p.datetime) as date,
-                    AVG(p.pm25) as pm25,
-                    AVG(p.pm10) as pm10,
-                    AVG(p.no2) as no2,
-                    AVG(p.o3) as o3
-                FROM polution p
-                " . $timeCondition . "
-                GROUP BY DATE(p.datetime)
-                ORDER BY DATE(p.datetime)";
+        $sql = dailyAveragesSql($timeCondition, ['pm25', 'pm10', 'no2', 'o3'], $useRollup);
         
         $result = $conn->query($sql);
         if (!$result) {
@@ -196,14 +299,7 @@ function getTimelineData($conn, $timeRange, $pollutantType) {
             $data['datasets'][3]['data'][] = $row['o3'];
         }
     } else {
-        $sql = "SELECT 
-                    DATE(p.datetime) as date,
-                    AVG(p." . $pollutantType . ") as avg_value
-                FROM polution p
-                " . $timeCondition . "
-                AND p." . $pollutantType . " IS NOT NULL
-                GROUP BY DATE(p.datetime)
-                ORDER BY DATE(p.datetime)";
+        $sql = dailyAverageSql($timeCondition, $pollutantType, $useRollup);
         
         $result = $conn->query($sql);
         if (!$result) {
@@ -229,11 +325,21 @@ function getTimelineData($conn, $timeRange, $pollutantType) {
     return $data;
 }
 
-function getAreaData($conn, $timeRange, $pollutantType) {
+function getAreaData($conn, $timeRange, $pollutantType, $useRollup = false) {
     $timeCondition = $timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "";
 
     if ($pollutantType === 'all') {
-        $sql = "SELECT 
+        $sql = $useRollup ? "SELECT 
+                    ms.name as area,
+                    " . rollupAverage('pm25') . " as pm25,
+                    " . rollupAverage('pm10') . " as pm10,
+                    " . rollupAverage('no2') . " as no2,
+                    " . rollupAverage('o3') . " as o3
+                FROM polution_daily r
+                JOIN meteo_station ms ON r.station_id = ms.id
+                " . rollupCondition($timeRange) . "
+                GROUP BY ms.name
+                ORDER BY ms.name" : "SELECT 
                     ms.name as area,
                     AVG(p.pm25) as pm25,
                     AVG(p.pm10) as pm10,
@@ -284,7 +390,15 @@ function getAreaData($conn, $timeRange, $pollutantType) {
             $data['datasets'][3]['data'][] = $row['o3'];
         }
     } else {
-        $sql = "SELECT 
+        $sql = $useRollup ? "SELECT 
+                    ms.name as area,
+                    " . rollupAverage($pollutantType) . " as avg_value
+                FROM polution_daily r
+                JOIN meteo_station ms ON r.station_id = ms.id
+                " . rollupCondition($timeRange) . "
+                AND r.pollutant = '" . $pollutantType . "'
+                GROUP BY ms.name
+                ORDER BY ms.name" : "SELECT 
                     ms.name as area,
                     AVG(p." . $pollutantType . ") as avg_value
                 FROM polution p
@@ -317,10 +431,16 @@ function getAreaData($conn, $timeRange, $pollutantType) {
     return $data;
 }
 
-function getDistributionData($conn, $timeRange) {
+function getDistributionData($conn, $timeRange, $useRollup = false) {
     $timeCondition = $timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "";
 
-    $sql = "SELECT 
+    $sql = $useRollup ? "SELECT 
+                COALESCE(SUM(CASE WHEN r.pollutant = 'pm25' THEN r.value_count END), 0) as pm25_count,
+                COALESCE(SUM(CASE WHEN r.pollutant = 'pm10' THEN r.value_count END), 0) as pm10_count,
+                COALESCE(SUM(CASE WHEN r.pollutant = 'no2' THEN r.value_count END), 0) as no2_count,
+                COALESCE(SUM(CASE WHEN r.pollutant = 'o3' THEN r.value_count END), 0) as o3_count
+            FROM polution_daily r
+            " . rollupCondition($timeRange) : "SELECT 
                 COUNT(CASE WHEN p.pm25 IS NOT NULL THEN 1 END) as pm25_count,
                 COUNT(CASE WHEN p.pm10 IS NOT NULL THEN 1 END) as pm10_count,
                 COUNT(CASE WHEN p.no2 IS NOT NULL THEN 1 END) as no2_count,
@@ -356,20 +476,12 @@ function getDistributionData($conn, $timeRange) {
     return $data;
 }
 
-function getTrendData($conn, $timeRange, $pollutantType) {
-    $timeCondition = $timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "";
+function getTrendData($conn, $timeRange, $pollutantType, $useRollup = false) {
+    $timeCondition = $useRollup ? rollupCondition($timeRange)
+        : ($timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "");
 
     if ($pollutantType === 'all') {
-        $sql = "SELECT 
-                    DATE(p.datetime) as date,
-                    AVG(p.pm25) as pm25,
-                    AVG(p.pm10) as pm10,
-                    AVG(p.no2) as no2,
-                    AVG(p.o3) as o3
-                FROM polution p
-                " . $timeCondition . "
-                GROUP BY DATE(p.datetime)
-                ORDER BY DATE(p.datetime)";
+        $sql = dailyAveragesSql($timeCondition, ['pm25', 'pm10', 'no2', 'o3'], $useRollup);
         
         $result = $conn->query($sql);
         if (!$result) {
@@ -418,14 +530,7 @@ function getTrendData($conn, $timeRange, $pollutantType) {
             $data['datasets'][3]['data'][] = $row['o3'];
         }
     } else {
-        $sql = "SELECT 
-                    DATE(p.datetime) as date,
-                    AVG(p." . $pollutantType . ") as avg_value
-                FROM polution p
-                " . $timeCondition . "
-                AND p." . $pollutantType . " IS NOT NULL
-                GROUP BY DATE(p.datetime)
-                ORDER BY DATE(p.datetime)";
+        $sql = dailyAverageSql($timeCondition, $pollutantType, $useRollup);
         
         $result = $conn->query($sql);
         if (!$result) {
@@ -452,19 +557,11 @@ function getTrendData($conn, $timeRange, $pollutantType) {
     return $data;
 }
 
-function getAdditionalMetricsData($conn, $timeRange) {
-    $timeCondition = $timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "";
+function getAdditionalMetricsData($conn, $timeRange, $useRollup = false) {
+    $timeCondition = $useRollup ? rollupCondition($timeRange)
+        : ($timeRange > 0 ? "WHERE p.datetime >= DATE_SUB(NOW(), INTERVAL " . $timeRange . " DAY)" : "");
 
-    $sql = "SELECT 
-                DATE(p.datetime) as date,
-                AVG(p.temperature) as temperature,
-                AVG(p.humidity) as humidity,
-                AVG(p.co) as co,
-                AVG(p.no) as no
-            FROM polution p
-            " . $timeCondition . "
-            GROUP BY DATE(p.datetime)
-            ORDER BY DATE(p.datetime)";
+    $sql = dailyAveragesSql($timeCondition, ['temperature', 'humidity', 'co', 'no'], $useRollup);
     
     $result = $conn->query($sql);
     if (!$result) {
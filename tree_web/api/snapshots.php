@@ -0,0 +1,115 @@
+<?php
+// Versioned JSON snapshots of read-heavy responses, served gzip-compressed
+// with an ETag while their version matches the data version. importData.py
+// bumps the version on every load and edits through the API bump it too;
+// the first request at a new version builds the response and saves it.
+// The snapshots are kept in SNAPSHOT_DIR, set in db_config.php.
+
+if (!defined('SNAPSHOT_DIR')) {
+    define('SNAPSHOT_DIR', sys_get_temp_dir() . DIRECTORY_SEPARATOR . 'treemapper_snapshots');
+}
+
+// Current data version, null if no import recorded one yet
+function dataVersion($conn) {
+    try {
+        $result = $conn->query("SELECT version FROM data_version WHERE id = 1");
+        $row = $result ? $result->fetch_assoc() : null;
+        return $row ? intval($row['version']) : null;
+    } catch (Exception $e) {
+        return null;
+    }
+}
+
+function bumpDataVersion($conn) {
+    try {
+        $conn->query("INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, NOW())
+                      ON DUPLICATE KEY UPDATE version = version + 1, updated_at = NOW()");
+    } catch (Exception $e) {
+        error_log("Failed to bump the data version: " . $e->getMessage());
+    }
+}
+
+// Serve the snapshot of a response if it is of the given data version (and
+// at most $maxAge seconds old, if given). Returns false if the response has
+// to be built live.
+function serveSnapshot($name, $version, $maxAge = 0) {
+    $metaFile = SNAPSHOT_DIR . '/' . $name . '.meta.json';
+    if ($version === null || !is_file($metaFile)) {
+        return false;
+    }
+    $meta = json_decode((string) @file_get_contents($metaFile), true);
+    if (!is_array($meta) || $meta['version'] !== $version
+        || ($maxAge > 0 && time() - $meta['rendered_at'] > $maxAge)) {
+        return false;
+    }
+    $file = SNAPSHOT_DIR . '/' . basename($meta['file']);
+    if (!is_file($file)) {
+        return false;
+    }
+
+    $etag = '"' . $meta['etag'] . '"';
+    header('ETag: ' . $etag);
+    header('Cache-Control: no-cache');
+    header('Vary: Accept-Encoding');
+    if (isset($_SERVER['HTTP_IF_NONE_MATCH']) && trim($_SERVER['HTTP_IF_NONE_MATCH']) === $etag) {
+        http_response_code(304);
+        return true;
+    }
+    if (isset($_SERVER['HTTP_ACCEPT_ENCODING']) && strpos($_SERVER['HTTP_ACCEPT_ENCODING'], 'gzip') !== false) {
+        header('Content-Encoding: gzip');
+        header('Content-Length: ' . filesize($file));
+        readfile($file);
+    } else {
+        echo gzdecode(file_get_contents($file));
+    }
+    return true;
+}
+
+// Save a response built live as the snapshot of the data version read before building it.
+// Failures are only logged: the filesystem functions report them as warnings,
+// which are silenced so they cannot end up in the JSON of the response.
+function saveSnapshot($name, $version, $json) {
+    if ($version === null) {
+        return;
+    }
+    if (!is_dir(SNAPSHOT_DIR) && !@mkdir(SNAPSHOT_DIR, 0775, true) && !is_dir(SNAPSHOT_DIR)) {
+        error_log("Failed to save snapshot " . $name . ": cannot create " . SNAPSHOT_DIR);
+        return;
+    }
+    if (!is_writable(SNAPSHOT_DIR)) {
+        error_log("Failed to save snapshot " . $name . ": " . SNAPSHOT_DIR . " is not writable");
+        return;
+    }
+
+    $file = $name . '.' . $version . '.json.gz';
+    $meta = [
+        'version' => $version,
+        'file' => $file,
+        'etag' => sha1($json),
+        'rendered_at' => time()
+    ];
+    // The data file goes first, so the meta file never points to a missing one
+    foreach ([$file => gzencode($json), $name . '.meta.json' => json_encode($meta)] as $path => $content) {
+        $tempFile = @tempnam(SNAPSHOT_DIR, 'tmp');
+        if ($tempFile === false) {
+            error_log("Failed to save snapshot " . $name . ": cannot create a file in " . SNAPSHOT_DIR);
+            return;
+        }
+        if (@file_put_contents($tempFile, $content) !== strlen($content)
+            || !@chmod($tempFile, 0644)
+            || !@rename($tempFile, SNAPSHOT_DIR . '/' . $path)) {
+            @unlink($tempFile);
+            error_log("Failed to save snapshot " . $name . ": cannot write " . $path);
+            return;
+        }
+    }
+
+    // Older versions go, except the previous one that requests may still be reading
+    foreach (glob(SNAPSHOT_DIR . '/' . $name . '.*.json.gz') ?: [] as $oldFile) {
+        $oldVersion = substr(basename($oldFile), strlen($name) + 1, -strlen('.json.gz'));
+        if (ctype_digit($oldVersion) && intval($oldVersion) < $version - 1) {
+            @unlink($oldFile);
+        }
+    }
+}
+?>
@@ -11,6 +11,7 @@ session_start();
 
 try {
     require_once 'db_config.php';
+    require_once 'snapshots.php';
 
     // Handle CORS
     header("Access-Control-Allow-Origin: *");
@@ -36,6 +37,9 @@ try {
         case 'get_all_trees':
             handleGetAllTrees($conn);
             break;
+        case 'get_tree_clusters':
+            handleGetTreeClusters($conn, $data);
+            break;
         case 'get_tree_by_id':
             handleGetTreeById($conn);
             break;
@@ -122,6 +126,12 @@ function handleGetAllTrees($conn) {
         }
         $stmt->close();
 
+        // Serve the snapshot of the current data version when there is one
+        $version = dataVersion($conn);
+        if (serveSnapshot('trees', $version)) {
+            return;
+        }
+
         // Get all trees with their type and location information
         $sql = "SELECT t.id, t.type_code, t.name, t.absolute_position_x, t.absolute_position_y, 
                        t.lat, t.lon, t.inserted_at, t.inserted_by, t.url, t.location_id,
@@ -171,12 +181,74 @@ function handleGetAllTrees($conn) {
             ];
         }
         
-        echo json_encode(['success' => true, 'trees' => $trees]);
+        $json = json_encode(['success' => true, 'trees' => $trees]);
+        saveSnapshot('trees', $version, $json);
+        echo $json;
     } catch (Exception $e) {
         echo json_encode(['success' => false, 'message' => 'Failed to fetch trees: ' . $e->getMessage()]);
     }
 }
 
+// Tree clusters of a zoom level in a range of slippy map tiles, precomputed by the importer
+function handleGetTreeClusters($conn, $data) {
+    try {
+        if (!isset($_SESSION['user_id'])) {
+            echo json_encode(['success' => false, 'message' => 'Not authenticated']);
+            return;
+        }
+
+        foreach (['zoom', 'min_x', 'max_x', 'min_y', 'max_y'] as $field) {
+            if (!isset($data[$field])) {
+                echo json_encode(['success' => false, 'message' => 'Zoom and tile range are required']);
+                return;
+            }
+        }
+
+        $sql = "SELECT c.tile_x, c.tile_y, c.tree_count, c.lat, c.lon, c.type_code,
+                       tt.greek_name, tt.scientific_name
+                FROM tree_cluster c
+                LEFT JOIN tree_type tt ON c.type_code = tt.id
+                WHERE c.zoom = ? AND c.tile_x BETWEEN ? AND ? AND c.tile_y BETWEEN ? AND ?";
+        $stmt = $conn->prepare($sql);
+        if (!$stmt) {
+            throw new Exception("Failed to prepare statement: " . $conn->error);
+        }
+
+        $zoom = intval($data['zoom']);
+        $minX = intval($data['min_x']);
+        $maxX = intval($data['max_x']);
+        $minY = intval($data['min_y']);
+        $maxY = intval($data['max_y']);
+        $stmt->bind_param("iiiii", $zoom, $minX, $maxX, $minY, $maxY);
+        if (!$stmt->execute()) {
+            throw new Exception("Failed to execute statement: " . $stmt->error);
+        }
+
+        $result = $stmt->get_result();
+
+        $clusters = [];
+        while ($row = $result->fetch_assoc()) {
+            $clusters[] = [
+                'tile_x' => $row['tile_x'],
+                'tile_y' => $row['tile_y'],
+                'count' => $row['tree_count'],
+                'lat' => $row['lat'],
+                'lon' => $row['lon'],
+                'dominant_type' => [
+                    'id' => $row['type_code'],
+                    'greek_name' => $row['greek_name'],
+                    'scientific_name' => $row['scientific_name']
+                ]
+            ];
+        }
+
+        echo json_encode(['success' => true, 'zoom' => $zoom, 'clusters' => $clusters]);
+        $stmt->close();
+    } catch (Exception $e) {
+        echo json_encode(['success' => false, 'message' => 'Failed to fetch tree clusters: ' . $e->getMessage()]);
+    }
+}
+
 function handleGetTreeById($conn) {
     try {
         // Fetch tree by id
@@ -196,13 +268,20 @@ function handleGetTreeById($conn) {
 
 function handleGetTreeTypes($conn) {
     try {
+        $version = dataVersion($conn);
+        if (serveSnapshot('tree_types', $version)) {
+            return;
+        }
+
         $sql = "SELECT id, greek_name, scientific_name, amount, type_id FROM tree_type";
         $result = $conn->query($sql);
         $treeTypes = [];
         while ($row = $result->fetch_assoc()) {
             $treeTypes[] = $row;
         }
-        echo json_encode(['success' => true, 'tree_types' => $treeTypes]);
+        $json = json_encode(['success' => true, 'tree_types' => $treeTypes]);
+        saveSnapshot('tree_types', $version, $json);
+        echo $json;
     } catch (Exception $e) {
         echo json_encode(['success' => false, 'message' => 'Failed to fetch tree types: ' . $e->getMessage()]);
     }
@@ -424,6 +503,7 @@ function handleAddTree($conn) {
         );
 
         if ($stmt->execute()) {
+            bumpDataVersion($conn);
             echo json_encode(['success' => true, 'message' => 'Tree added successfully']);
         } else {
             // If insert fails, delete uploaded image
@@ -474,6 +554,7 @@ function handleUpdateTreeType($conn, $data) {
         );
         
         if ($stmt->execute()) {
+            bumpDataVersion($conn);
             echo json_encode(['success' => true, 'message' => 'Tree type updated successfully']);
         } else {
             echo json_encode(['success' => false, 'message' => 'Failed to update tree type']);
@@ -570,6 +651,7 @@ function handleDeleteTreeType($conn, $data) {
         $stmt->bind_param("i", $data['id']);
         
         if ($stmt->execute()) {
+            bumpDataVersion($conn);
             echo json_encode(['success' => true, 'message' => 'Tree type deleted successfully']);
         } else {
             echo json_encode(['success' => false, 'message' => 'Failed to delete tree type']);
@@ -613,6 +695,7 @@ function handleUpdateTree($conn, $data) {
         );
         
         if ($stmt->execute()) {
+            bumpDataVersion($conn);
             echo json_encode(['success' => true, 'message' => 'Tree updated successfully']);
         } else {
             echo json_encode(['success' => false, 'message' => 'Failed to update tree']);
@@ -663,6 +746,7 @@ function handleDeleteTree($conn, $data) {
         $stmt->bind_param("i", $data['id']);
         
         if ($stmt->execute()) {
+            bumpDataVersion($conn);
             echo json_encode(['success' => true, 'message' => 'Tree deleted successfully']);
         } else {
             echo json_encode(['success' => false, 'message' => 'Failed to delete tree']);
@@ -719,6 +803,7 @@ function handleAddTreeType($conn, $data) {
         $stmt->bind_param("ss", $data['greek_name'], $data['scientific_name']);
         
         if ($stmt->execute()) {
+            bumpDataVersion($conn);
             echo json_encode([
                 'success' => true, 
                 'message' => 'Tree type added successfully',